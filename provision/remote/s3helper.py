@@ -1,57 +1,555 @@
 # coding: utf-8
 from boto.exception import S3ResponseError
 from boto.s3.connection import S3Connection
+from boto.s3.multipart import MultiPartUpload
+from boto.s3.prefix import Prefix
+from boto.utils import parse_ts
+from collections import deque
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import calendar
+import hashlib
+import json
 import os
+import posixpath
+import re
 import subprocess
+import tempfile
+import threading
+import time
 
+# Size of the parts of multipart transfers, and the number of parts transferred at once
+PART_SIZE = 64 * 1024 * 1024
+CONCURRENCY = 8
 
-def _run_command(command, detail=False):
-    proc = subprocess.Popen(command.split(),
+# S3 rejects parts smaller than this, except for the last part of a file
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Attempts made for every part before the transfer is given up, to be resumed later
+PART_ATTEMPTS = 3
+
+# Most files, and most characters of file paths, copied by one `hdfs dfs -cp`, and the number
+# of copies run at once
+HDFS_COPY_FILES = 200
+HDFS_COPY_LENGTH = 64 * 1024
+HDFS_COPY_CONCURRENCY = 4
+
+# Seconds a file may be newer than its copy before a sync copies it again. HDFS lists
+# modification times to the minute.
+SYNC_TOLERANCE = 60
+
+# Suffix of the keys Hadoop's s3n filesystem creates to mark directories
+FOLDER_SUFFIX = '_$folder$'
+
+# Seconds between checks of a running command for its timeout and cancellation, and the last
+# lines of its errors kept for the result
+POLL_INTERVAL = 0.1
+ERROR_LINES = 100
+
+# The progress reported by distcp and MapReduce jobs in their logs
+PROGRESS_PATTERNS = [
+    ('percent', re.compile(r'\bmap (\d+)%')),
+    ('bytes', re.compile(r'\bBytes Copied=(\d+)')),
+    ('bytes_expected', re.compile(r'\bBytes Expected=(\d+)')),
+    ('files', re.compile(r'\bFiles Copied=(\d+)')),
+]
+
+# The id of the YARN application of a MapReduce job, from "Running job: job_<id>" or
+# "Submitted application application_<id>". Killing the command that submitted the job does not
+# stop it, so it is killed through YARN, waiting at most KILL_TIMEOUT seconds.
+APPLICATION_PATTERN = re.compile(r'\b(?:job|application)_(\d+_\d+)\b')
+KILL_TIMEOUT = 60
+
+# Every worker thread opens its own connection to S3
+_local = threading.local()
+
+# The outcome of a command. `out` is None unless its output was kept, `err` holds the last
+# ERROR_LINES lines of its errors and `progress` the last progress it reported, along with the
+# 'application_id' of the YARN application it submitted, if any.
+_Result = namedtuple('_Result', ['returncode', 'out', 'err', 'progress', 'timed_out',
+                                 'cancelled'])
+
+
+def _parse_progress(line, progress):
+    # Update `progress` from a log line and return whether it changed
+    match = APPLICATION_PATTERN.search(line)
+    if match and 'application_id' not in progress:
+        progress['application_id'] = 'application_' + match.group(1)
+
+    changed = False
+    for name, pattern in PROGRESS_PATTERNS:
+        match = pattern.search(line)
+        if match and progress.get(name) != int(match.group(1)):
+            progress[name] = int(match.group(1))
+            changed = True
+    return changed
+
+
+def _print_progress(progress):
+    parts = []
+    if 'percent' in progress:
+        parts.append("%d%%" % progress['percent'])
+    if 'files' in progress:
+        parts.append("%d files" % progress['files'])
+    if 'bytes' in progress:
+        if 'bytes_expected' in progress:
+            parts.append("%d of %d bytes" % (progress['bytes'], progress['bytes_expected']))
+        else:
+            parts.append("%d bytes" % progress['bytes'])
+    print("Progress: " + ", ".join(parts))
+
+
+def _drain(stream, lines, progress, detail):
+    # Read a pipe of the command until it closes, so the command never blocks on a full pipe
+    for line in iter(stream.readline, b''):
+        line = line.decode('utf-8', 'replace').rstrip('\n')
+        if lines is not None:
+            lines.append(line)
+        if _parse_progress(line, progress) and detail:
+            _print_progress(progress)
+    stream.close()
+
+
+def _kill_application(progress):
+    # Kill the YARN application of a MapReduce job whose client was killed
+    if 'application_id' in progress:
+        result = _run_command(["/usr/bin/yarn", "application", "-kill",
+                               progress['application_id']], timeout=KILL_TIMEOUT)
+        if result.returncode != 0:
+            print("Could not kill %s, please kill it with `yarn application -kill`: %s"
+                  % (progress['application_id'], result.err))
+
+
+def _run_command(args, detail=False, timeout=None, cancel=None, keep_output=True):
+    """Run a command given as a list of arguments, so paths with spaces stay whole.
+
+        Its output and errors are read at the same time by two threads
+        while it runs. With `detail`, the progress parsed from them is
+        printed as it changes. The command is killed after `timeout`
+        seconds, when the threading.Event `cancel` is set, or when the
+        notebook is interrupted, which raises KeyboardInterrupt again
+        once the command has stopped. If it had submitted a MapReduce
+        job, like distcp, the job is killed through YARN too.
+
+        Returns a _Result.
+    """
+    proc = subprocess.Popen(args,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE)
-    if detail:
-        while True:
-            line = proc.stdout.readline()
-            if not line:
-                break
-            print(line)
-    return proc.communicate()
+    out = [] if keep_output else None
+    err = deque(maxlen=ERROR_LINES)
+    progress = dict()
+    readers = [threading.Thread(target=_drain, args=(proc.stdout, out, progress, detail)),
+               threading.Thread(target=_drain, args=(proc.stderr, err, progress, detail))]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    started = time.time()
+    timed_out = cancelled = False
+    try:
+        while proc.poll() is None:
+            if timeout is not None and time.time() - started > timeout:
+                timed_out = True
+            elif cancel is not None and cancel.is_set():
+                cancelled = True
+            else:
+                time.sleep(POLL_INTERVAL)
+                continue
+            proc.kill()
+            proc.wait()
+    except KeyboardInterrupt:
+        proc.kill()
+        proc.wait()
+        for reader in readers:
+            reader.join()
+        _kill_application(progress)
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+
+    if timed_out or cancelled:
+        _kill_application(progress)
+
+    if timed_out:
+        err.append("Command timed out after %s seconds: %s" % (timeout, " ".join(args)))
+    elif cancelled:
+        err.append("Command cancelled: %s" % " ".join(args))
+    return _Result(proc.returncode,
+                   "\n".join(out) if out is not None else None,
+                   "\n".join(err),
+                   progress,
+                   timed_out,
+                   cancelled)
 
 
 def _list_hdfs(path):
-    command = "/usr/bin/hdfs dfs -ls %s" % path
-    out, err = _run_command(command)
-    if out:
-        print(out)
+    result = _run_command(["/usr/bin/hdfs", "dfs", "-ls", path])
+    if result.out:
+        print(result.out)
 
 
-def _s3_to_hdfs(files, tgt):
-    out, err1 = _run_command("/usr/bin/hdfs dfs -mkdir -p %s" % tgt)
-    if err1:
-        print(err1)
+def _ls_hdfs_files(args):
+    # (path, size, modification time) of every file listed by `hdfs dfs -ls`
+    result = _run_command(["/usr/bin/hdfs", "dfs", "-ls"] + args)
+    if result.returncode != 0:
         return
-    out, err2 = _run_command("/usr/bin/hdfs dfs -cp %s %s" % (files, tgt))
-    if err2:
-        print(err2)
+    for line in result.out.splitlines():
+        # -rw-r--r--   1 hadoop hadoop       1234 2018-01-01 00:00 /path/to/file
+        fields = line.split(None, 7)
+        if len(fields) == 8 and fields[0].startswith('-'):
+            mtime = calendar.timegm(time.strptime(fields[5] + ' ' + fields[6], '%Y-%m-%d %H:%M'))
+            yield fields[7], int(fields[4]), mtime
+
+
+def _hdfs_sizes(path):
+    # The sizes of the files directly in the HDFS directory `path`, keyed by file name
+    return dict((name.rsplit('/', 1)[-1], size) for name, size, _ in _ls_hdfs_files([path]))
+
+
+def _hdfs_files(path):
+    # (size, modification time) of every file under the HDFS directory `path`, keyed by the
+    # path relative to it
+    files = dict()
+    for name, size, mtime in _ls_hdfs_files(["-R", path]):
+        if name.startswith(path):
+            files[name[len(path):]] = (size, mtime)
+    return files
+
+
+def _is_directory(key_name):
+    # Whether the key only marks a directory. `hdfs dfs -mkdir` on s3n:// creates
+    # "<directory>_$folder$" keys, other tools "<directory>/" keys.
+    return key_name.endswith('/') or key_name.endswith(FOLDER_SUFFIX)
+
+
+def _s3_files(bucket, prefix):
+    # (size, modification time) of every file under `prefix` in the bucket, keyed by the path
+    # relative to it
+    files = dict()
+    for key in bucket.list(prefix=prefix):
+        if not _is_directory(key.name):
+            mtime = calendar.timegm(parse_ts(key.last_modified).timetuple())
+            files[key.name[len(prefix):]] = (key.size, mtime)
+    return files
 
 
-def _hdfs_to_s3(files, tgt):
-    out, err = _run_command("/usr/bin/hadoop distcp %s %s" % (files, tgt), True)
-    if err:
-        print(err)
+def _delta(source, target):
+    # The names of the files of `source` that are missing from `target`, and of those whose
+    # size differs or that were modified after their copy in `target`
+    new, changed = [], []
+    for name in sorted(source):
+        size, mtime = source[name]
+        if name not in target:
+            new.append(name)
+        elif target[name][0] != size or mtime > target[name][1] + SYNC_TOLERANCE:
+            changed.append(name)
+    return new, changed
+
+
+def _chunks(files, max_files, max_length):
+    # Split the files into chunks short enough to be passed as the arguments of one command
+    chunk = []
+    length = 0
+    for path in files:
+        if chunk and (len(chunk) >= max_files or length + len(path) + 1 > max_length):
+            yield chunk
+            chunk = []
+            length = 0
+        chunk.append(path)
+        length += len(path) + 1
+    if chunk:
+        yield chunk
+
+
+def _copy_chunk(task):
+    files, tgt, cancel = task
+    return files, _run_command(["/usr/bin/hdfs", "dfs", "-cp", "-f"] + files + [tgt],
+                               cancel=cancel)
+
+
+def _copy_chunks(tasks, concurrency):
+    # Run the (files, target directory) copies, `concurrency` at a time. Returns the
+    # (files, error) of every chunk that failed.
+    if not tasks:
+        return []
+
+    failed = []
+    done = 0
+    total = sum(len(files) for files, _ in tasks)
+    cancel = threading.Event()
+    pool = ThreadPool(max(1, min(concurrency, len(tasks))))
+    try:
+        for chunk, result in pool.imap_unordered(_copy_chunk,
+                                                 [(files, tgt, cancel) for files, tgt in tasks]):
+            done += len(chunk)
+            if result.returncode != 0:
+                failed.append((chunk, result.err.strip()))
+            print("Copied %d of %d files, %d chunks failed" % (done, total, len(failed)))
+    except BaseException:
+        # Start no more chunks and kill the running copies, e.g. when the notebook is
+        # interrupted, then wait for them to stop
+        cancel.set()
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    return failed
+
+
+def _s3_to_hdfs(files, tgt, concurrency):
+    # Copy the files into `tgt` in chunks, `concurrency` chunks at a time
+    return _copy_chunks([(chunk, tgt) for chunk in _chunks(files, HDFS_COPY_FILES,
+                                                           HDFS_COPY_LENGTH)],
+                        concurrency)
+
+
+def _sync(source, source_url, target, target_url, dry_run, concurrency):
+    # Copy the files of the `source` listing that are new or changed in the `target` listing
+    # from under `source_url` to the same relative paths under `target_url`
+    new, changed = _delta(source, target)
+    result = dict(new=new, changed=changed, unchanged=len(source) - len(new) - len(changed),
+                  copied=0, failed=[])
+    if dry_run:
+        for name in new:
+            print("new: %s" % name)
+        for name in changed:
+            print("changed: %s" % name)
+        print("%d new, %d changed and %d unchanged files"
+              % (len(new), len(changed), result["unchanged"]))
+        return result
+
+    # `hdfs dfs -cp` copies many files at once only into a directory that exists
+    groups = dict()
+    for name in new + changed:
+        groups.setdefault(posixpath.dirname(target_url + name), []).append(source_url + name)
+    for directories in _chunks(sorted(groups), HDFS_COPY_FILES, HDFS_COPY_LENGTH):
+        mkdir = _run_command(["/usr/bin/hdfs", "dfs", "-mkdir", "-p"] + directories)
+        if mkdir.returncode != 0:
+            print(mkdir.err)
+            return result
+
+    tasks = [(chunk, directory) for directory in sorted(groups)
+             for chunk in _chunks(groups[directory], HDFS_COPY_FILES, HDFS_COPY_LENGTH)]
+    result["failed"] = _copy_chunks(tasks, concurrency)
+    failed_files = sum(len(chunk) for chunk, _ in result["failed"])
+    result["copied"] = len(new) + len(changed) - failed_files
+    print("Copied %d new and changed files, %d files unchanged, %d files failed"
+          % (result["copied"], result["unchanged"], failed_files))
+    for chunk, error in result["failed"]:
+        print(error)
+    return result
+
+
+def _s3_to_hdfs_distcp(files, tgt, timeout=None):
+    # Copy the files with one distcp job that reads their paths from a file list on HDFS
+    if not files:
+        return []
+
+    fd, list_file = tempfile.mkstemp(prefix='s3helper-', suffix='.txt')
+    with os.fdopen(fd, 'w') as stream:
+        stream.write('\n'.join(files) + '\n')
+    hdfs_list_file = '/tmp/' + os.path.basename(list_file)
+    try:
+        result = _run_command(["/usr/bin/hdfs", "dfs", "-put", "-f", list_file,
+                               hdfs_list_file])
+        if result.returncode == 0:
+            try:
+                result = _run_command(["/usr/bin/hadoop", "distcp", "-f", hdfs_list_file, tgt],
+                                      detail=True, timeout=timeout, keep_output=False)
+            finally:
+                _run_command(["/usr/bin/hdfs", "dfs", "-rm", "-skipTrash", hdfs_list_file])
+    finally:
+        os.remove(list_file)
+
+    if result.returncode != 0:
+        return [(files, result.err.strip())]
+    return []
+
+
+def _hdfs_to_s3(files, tgt, timeout=None):
+    result = _run_command(["/usr/bin/hadoop", "distcp", files, tgt], detail=True,
+                          timeout=timeout, keep_output=False)
+    if result.returncode != 0:
+        print(result.err)
+    return result
 
 
 def _local_to_hdfs(src, tgt):
     if tgt[0] != '/':
         tgt = '/' + tgt
-    out, err1 = _run_command("/usr/bin/hdfs dfs -mkdir -p %s" % tgt)
-    if err1:
-        print(err1)
+    result = _run_command(["/usr/bin/hdfs", "dfs", "-mkdir", "-p", tgt])
+    if result.returncode != 0:
+        print(result.err)
         return
-    out, err2 = _run_command("/usr/bin/hdfs dfs -cp %s %s" % ("file://" + os.path.join(src, '*'),
-                                                              tgt))
-    if err2:
-        print(err2)
+    # hdfs expands the wildcard itself
+    result = _run_command(["/usr/bin/hdfs", "dfs", "-cp", "file://" + os.path.join(src, '*'),
+                           tgt])
+    if result.returncode != 0:
+        print(result.err)
+
+
+def _bucket(bucket_name):
+    # The bucket on the connection of the current thread
+    if not hasattr(_local, 'buckets'):
+        _local.buckets = dict()
+    if bucket_name not in _local.buckets:
+        connection = S3Connection(host="s3.amazonaws.com")
+        _local.buckets[bucket_name] = connection.get_bucket(bucket_name, validate=False)
+    return _local.buckets[bucket_name]
+
+
+def _parts(size, part_size):
+    # (part number, offset, length) of every part of a file of `size` bytes
+    return [(number + 1, offset, min(part_size, size - offset))
+            for number, offset in enumerate(range(0, size, part_size))]
+
+
+def _md5(filename, offset, length):
+    digest = hashlib.md5()
+    with open(filename, 'rb') as fp:
+        fp.seek(offset)
+        while length > 0:
+            data = fp.read(min(length, 1024 * 1024))
+            if not data:
+                break
+            digest.update(data)
+            length -= len(data)
+    return digest.hexdigest()
+
+
+def _attempt(task):
+    # Run a part transfer, retrying it, and return the error of the last attempt if it failed
+    function, args = task
+    error = None
+    for _ in range(PART_ATTEMPTS):
+        try:
+            function(*args)
+            return None
+        except Exception as e:
+            error = e
+    return error
+
+
+def _run_parts(tasks, concurrency):
+    # Run the part transfers of every file on one pool of worker threads and return the errors
+    pool = ThreadPool(max(1, min(concurrency, len(tasks))))
+    try:
+        errors = [error for error in pool.map(_attempt, tasks, 1) if error is not None]
+    except BaseException:
+        # Start no more parts and return without waiting for the running ones, e.g. when the
+        # notebook is interrupted. Calling again resumes from the parts that were done.
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return errors
+
+
+def _plan_upload(bucket, filename, key_name, part_size):
+    # Return the upload of the file, and the part transfers it still needs. Parts of a
+    # previous multipart upload of the key that match the file are not sent again.
+    size = os.path.getsize(filename)
+    if size <= part_size:
+        return None, [(_put_file, (bucket.name, filename, key_name))]
+
+    parts = _parts(size, part_size)
+    upload = None
+    for existing in bucket.get_all_multipart_uploads(prefix=key_name):
+        if existing.key_name == key_name:
+            upload = existing
+            break
+
+    uploaded = dict()
+    if upload is not None:
+        uploaded = dict((part.part_number, part) for part in upload)
+        # An upload of a different version of the file, or with other part sizes, is dropped
+        if any(number > len(parts) or part.size != parts[number - 1][2]
+               for number, part in uploaded.items()):
+            upload.cancel_upload()
+            upload = None
+            uploaded = dict()
+    if upload is None:
+        upload = bucket.initiate_multipart_upload(key_name)
+
+    tasks = []
+    for number, offset, length in parts:
+        part = uploaded.get(number)
+        if part is not None and part.etag.strip('"') == _md5(filename, offset, length):
+            continue
+        tasks.append((_put_part, (bucket.name, key_name, upload.id, filename, number, offset,
+                                  length)))
+    return upload, tasks
+
+
+def _put_file(bucket_name, filename, key_name):
+    _bucket(bucket_name).new_key(key_name).set_contents_from_filename(filename)
+
+
+def _put_part(bucket_name, key_name, upload_id, filename, number, offset, length):
+    upload = MultiPartUpload(_bucket(bucket_name))
+    upload.key_name = key_name
+    upload.id = upload_id
+    with open(filename, 'rb') as fp:
+        fp.seek(offset)
+        upload.upload_part_from_file(fp, number, size=length)
+
+
+class _Download:
+    """The download of one S3 key into a local file.
+
+    Parts are written into `<tgt>.part` in place. The parts that are done
+    are recorded in `<tgt>.parts`, so a download that failed resumes where
+    it stopped as long as the key has not changed.
+    """
+
+    def __init__(self, key, tgt, part_size):
+        self.key_name = key.name
+        self.tgt = tgt
+        self.temp = tgt + '.part'
+        self.state = tgt + '.parts'
+        self._lock = threading.Lock()
+
+        etag = key.etag.strip('"')
+        self.done = set()
+        if os.path.isfile(self.state) and os.path.isfile(self.temp):
+            with open(self.state, 'r') as stream:
+                state = json.load(stream)
+            if state.get('etag') == etag and state.get('part_size') == part_size:
+                self.done = set(state['done'])
+        if not self.done:
+            with open(self.temp, 'wb') as fp:
+                fp.truncate(key.size)
+        self._state = dict(etag=etag, part_size=part_size)
+        parts = _parts(key.size, part_size)
+        self.total = len(parts)
+        self.parts = [part for part in parts if part[0] not in self.done]
+
+    def tasks(self, bucket_name):
+        return [(self.get_part, (bucket_name, number, offset, length))
+                for number, offset, length in self.parts]
+
+    def get_part(self, bucket_name, number, offset, length):
+        key = _bucket(bucket_name).new_key(self.key_name)
+        with open(self.temp, 'r+b') as fp:
+            fp.seek(offset)
+            key.get_contents_to_file(
+                fp, headers={'Range': 'bytes=%d-%d' % (offset, offset + length - 1)})
+        with self._lock:
+            self.done.add(number)
+            with open(self.state, 'w') as stream:
+                json.dump(dict(self._state, done=sorted(self.done)), stream)
+
+    def finish(self):
+        # Move the file in place once every part is done
+        if len(self.done) < self.total:
+            return False
+        os.rename(self.temp, self.tgt)
+        if os.path.isfile(self.state):
+            os.remove(self.state)
+        return True
 
 
 class S3Helper:
@@ -60,6 +558,8 @@ class S3Helper:
         self.conn = None
         self.bucket_name = None
         self.bucket = None
+        self.part_size = PART_SIZE
+        self.concurrency = CONCURRENCY
 
     @staticmethod
     def help():
@@ -75,6 +575,9 @@ class S3Helper:
             s3helper.ls() or s3helper.ls_s3()
         Or optionally,
             s3helper.ls(<file_path>) or s3helper.ls_s3(<file_path>)
+        To go through a large directory without waiting for the whole
+        listing, with the size and the last modified time of every file,
+            for path, size, last_modified in s3helper.iter_s3(<file_path>, True): ...
         3. List all files on HDFS
             s3helper.ls_hdfs()
         Or optionally,
@@ -86,14 +589,26 @@ class S3Helper:
         1. Transfer files between S3 and HDFS
           a. To download all S3 files under a directory to HDFS, please call
                 s3helper.s3_to_hdfs(<s3_directory_path>, <HDFS_directory_path>)
+             Files already on HDFS with the same size are skipped, so calling
+             it again resumes a copy that failed. For very many files, add
+             distcp=True to copy them with a single MapReduce job.
           b. To upload a directory on HDFS to S3, please call
                 s3helper.hdfs_to_s3(<HDFS_directory_path>, <s3_directory_path>)
+          c. To copy only the files that are new or changed since the last
+             copy, keeping their paths, please call
+                s3helper.sync_s3_to_hdfs(<s3_directory_path>, <HDFS_directory_path>)
+                s3helper.sync_hdfs_to_s3(<HDFS_directory_path>, <s3_directory_path>)
+             Add dry_run=True to only list the files that would be copied.
 
         2. Transfer files between S3 and local filesystem (not HDFS)
-          a. To download one single S3 file to local filesystem, please call
+          a. To download a S3 file or directory to local filesystem, please call
                 s3helper.s3_to_local(<s3_file_path>, <local_file_path>)
-          b. To upload a file on local filesystem to S3, please call
+          b. To upload a file or directory on local filesystem to S3, please call
                 s3helper.local_to_s3(<local_file_path>, <s3_directory_path>)
+          Large files are transferred in parts by several threads at once. Call
+          the same method again to resume a transfer that failed. To change the
+          size of the parts and the number of threads, please call
+                s3helper.set_transfer_config(<part_size_in_bytes>, <threads>)
 
         3. Transfer files between local filesystem and HDFS
           a. To upload a directory on local filesystem to HDFS, please call
@@ -160,12 +675,33 @@ class S3Helper:
         return self.ls_s3(path)
 
     def ls_s3(self, path=''):
-        """List all files in `path` on S3.
+        """List the files and directories directly in `path` on S3.
+
+            Args:
+                path
+            Returns:
+                a sorted array of files in `path`
+        """
+        return sorted(self.iter_s3(path))
+
+    def iter_s3(self, path='', details=False):
+        """Iterate over the files and directories directly in `path` on S3.
+
+            Only one level is listed: S3 returns the keys under `path`
+            grouped by the next '/', so the time taken depends on the
+            number of entries in `path` and not on the number of files
+            below it. Entries are yielded page by page as S3 returns
+            them, with the files of a page before its directories, so
+            they are not sorted. ls_s3 returns them sorted.
 
             Args:
                 path
+                details - also yield the size in bytes and the last
+                          modified time of every entry, which are None
+                          for directories
             Returns:
-                an array of files in `path`
+                a generator of paths in `path`, or of
+                (path, size, last_modified) tuples if details is True
         """
         if not self.bucket:
             raise Exception('No bucket is opened. '
@@ -174,14 +710,30 @@ class S3Helper:
         path = path.strip()
         if len(path) and path[0] == '/':
             path = path[1:]
-        files = self.bucket.list(prefix=path)
+        prefix = path
+        if prefix and prefix[-1] != '/':
+            prefix = prefix + '/'
 
-        if path == '':
-            k = 1
-        else:
-            k = len(path.split('/')) + 1
-        return sorted(list(set(
-            ['/'.join(t.key.split('/')[:k]) for t in files])))
+        found = False
+        for entry in self.bucket.list(prefix=prefix, delimiter='/'):
+            found = True
+            # Directories are returned as Prefix objects that end with '/'
+            name = entry.name.rstrip('/')
+            if not details:
+                yield name
+            elif isinstance(entry, Prefix):
+                yield name, None, None
+            else:
+                yield name, entry.size, entry.last_modified
+
+        # `path` may be a single file instead of a directory
+        if not found and path and path[-1] != '/':
+            key = self.bucket.get_key(path)
+            if key is not None:
+                if details:
+                    yield key.name, key.size, key.last_modified
+                else:
+                    yield key.name
 
     @staticmethod
     def ls_hdfs(path='/'):
@@ -209,13 +761,26 @@ class S3Helper:
         prefix = "s3n://%s/" % self.bucket_name
         return [prefix + t.key for t in files]
 
-    def s3_to_hdfs(self, src, tgt):
+    def s3_to_hdfs(self, src, tgt, concurrency=HDFS_COPY_CONCURRENCY, distcp=False,
+                   timeout=None):
         """Load all files in `src` to the directory `tgt` in HDFS.
 
+            The files are copied in chunks of at most HDFS_COPY_FILES
+            files, `concurrency` chunks at a time, and the progress is
+            printed after every chunk. Files already in `tgt` with the
+            same size are skipped, so calling this method again after a
+            failure only copies what is missing.
+
             Args:
                 src, tgt
+                concurrency - number of chunks copied at once
+                distcp - copy with a single distcp MapReduce job instead,
+                         which is faster for very many files, and print
+                         its progress
+                timeout - seconds after which the distcp job is killed
             Returns:
-                an array of file paths in HDFS
+                a dict with the number of files `copied` and `skipped`,
+                and the (files, error) of every chunk that `failed`
         """
         if not self.bucket:
             raise Exception('no bucket is opened.')
@@ -227,18 +792,50 @@ class S3Helper:
             tgt = '/' + tgt
         if tgt[-1] != '/':
             tgt = tgt + '/'
-        files = self.bucket.list(prefix=src)
+
+        result = _run_command(["/usr/bin/hdfs", "dfs", "-mkdir", "-p", tgt])
+        if result.returncode != 0:
+            print(result.err)
+            return dict(copied=0, skipped=0, failed=[])
+
+        # The files are copied into `tgt` itself, under their file names
+        existing = _hdfs_sizes(tgt)
         prefix = "s3n://%s/" % self.bucket_name
-        _s3_to_hdfs(' '.join([prefix + t.key for t in files]), tgt)
-        self.ls_hdfs(tgt)
+        files = []
+        skipped = 0
+        for key in self.bucket.list(prefix=src):
+            if _is_directory(key.name):
+                continue
+            if existing.get(key.name.rsplit('/', 1)[-1]) == key.size:
+                skipped += 1
+            else:
+                files.append(prefix + key.name)
+
+        if distcp:
+            failed = _s3_to_hdfs_distcp(files, tgt, timeout)
+        else:
+            failed = _s3_to_hdfs(files, tgt, concurrency)
+
+        failed_files = sum(len(chunk) for chunk, _ in failed)
+        print("Copied %d files, skipped %d files already in %s, %d files failed"
+              % (len(files) - failed_files, skipped, tgt, failed_files))
+        for chunk, error in failed:
+            print(error)
+        return dict(copied=len(files) - failed_files, skipped=skipped, failed=failed)
 
-    def hdfs_to_s3(self, src, tgt):
+    def hdfs_to_s3(self, src, tgt, timeout=None):
         """Upload a directory `src` on HDFS to a directory `tgt` on S3.
 
+           The progress of the distcp job is printed while it runs.
+           Interrupting the notebook, or the timeout, kills the job on
+           YARN once it has been submitted.
+
            Args:
                 src, tgt
+                timeout - seconds after which the distcp job is killed
            Returns:
-                file list of the `tgt` directory on S3 after uploading
+                a _Result with the returncode, the last lines of the
+                errors and the last progress of the distcp job
         """
         if not self.bucket:
             raise Exception('no bucket is opened. '
@@ -255,13 +852,93 @@ class S3Helper:
         print("*NOTE*\n"
               "This method will create a MapReudce job to upload the content "
               "in HDFS to S3. The process may take a while.\n\n")
-        _hdfs_to_s3(src, tgt)
+        return _hdfs_to_s3(src, tgt, timeout)
+
+    def _sync_paths(self, s3_path, hdfs_path):
+        # The S3 prefix and the HDFS directory of a sync, both ending with '/'
+        if not self.bucket:
+            raise Exception('no bucket is opened.')
+
+        s3_path, hdfs_path = s3_path.strip(), hdfs_path.strip()
+        if len(s3_path) and s3_path[0] == '/':
+            s3_path = s3_path[1:]
+        if s3_path and s3_path[-1] != '/':
+            s3_path = s3_path + '/'
+        if hdfs_path == '' or (hdfs_path[0] != '/' and not hdfs_path.startswith('hdfs://')):
+            hdfs_path = '/' + hdfs_path
+        if hdfs_path[-1] != '/':
+            hdfs_path = hdfs_path + '/'
+        return s3_path, hdfs_path
+
+    def sync_s3_to_hdfs(self, src, tgt, dry_run=False, concurrency=HDFS_COPY_CONCURRENCY):
+        """Copy the files in `src` on S3 that are new or changed to the
+           directory `tgt` on HDFS, keeping their paths below `src`.
+
+            A file is changed if its size differs from its copy, or if it
+            was modified more than SYNC_TOLERANCE seconds after it.
+
+            Args:
+                src, tgt
+                dry_run - only print the files that would be copied
+                concurrency - number of chunks of files copied at once
+            Returns:
+                a dict with the names of the `new` and `changed` files,
+                the number of files `unchanged` and `copied`, and the
+                (files, error) of every chunk that `failed`
+        """
+        src, tgt = self._sync_paths(src, tgt)
+        return _sync(_s3_files(self.bucket, src), "s3n://%s/%s" % (self.bucket_name, src),
+                     _hdfs_files(tgt), tgt, dry_run, concurrency)
+
+    def sync_hdfs_to_s3(self, src, tgt, dry_run=False, concurrency=HDFS_COPY_CONCURRENCY):
+        """Copy the files in `src` on HDFS that are new or changed to the
+           directory `tgt` on S3, keeping their paths below `src`.
+
+            See sync_s3_to_hdfs.
+
+            Args:
+                src, tgt
+                dry_run - only print the files that would be copied
+                concurrency - number of chunks of files copied at once
+            Returns:
+                the same dict as sync_s3_to_hdfs
+        """
+        tgt, src = self._sync_paths(tgt, src)
+        return _sync(_hdfs_files(src), src, _s3_files(self.bucket, tgt),
+                     "s3n://%s/%s" % (self.bucket_name, tgt), dry_run, concurrency)
+
+    def set_transfer_config(self, part_size=None, concurrency=None):
+        """Set how files are transferred between S3 and local filesystem.
+
+            Args:
+                part_size - bytes in every part of a multipart transfer,
+                            at least 5 MB
+                concurrency - number of parts transferred at once
+            Returns:
+                None
+        """
+        if part_size is not None:
+            if part_size < MIN_PART_SIZE:
+                raise ValueError('part_size must be at least %d bytes.' % MIN_PART_SIZE)
+            self.part_size = int(part_size)
+        if concurrency is not None:
+            if concurrency < 1:
+                raise ValueError('concurrency must be at least 1.')
+            self.concurrency = int(concurrency)
 
     def local_to_s3(self, filename, tgt):
-        """Save a local file `filename` to the directory `tgt` on S3.
+        """Save a local file or directory `filename` as `tgt` on S3.
+
+            Files larger than the part size are sent as multipart uploads
+            whose parts, and the files of a directory, are sent at once by
+            `concurrency` threads (see set_transfer_config). If a transfer
+            fails, calling this method again resumes it: the parts that
+            already reached S3 are not sent again.
 
             Args:
-                filename, tgt
+                filename - a local file or directory
+                tgt - the S3 path of the file, or the S3 directory the
+                      files of the directory are saved under
             Returns:
                 None
         """
@@ -269,40 +946,87 @@ class S3Helper:
             raise Exception('no bucket is opened.')
         if not os.path.exists(filename):
             raise Exception("File does not exist.")
-        if os.path.isdir(filename):
-            raise Exception(
-                "Transfer between S3 and local filesystem "
-                "does not support directory.")
 
         tgt = tgt.strip()
         if len(tgt) and tgt[0] == '/':
             tgt = tgt[1:]
         if not tgt:
-            tgt = filename.rsplit('/', 1)[-1]
-        k = self.bucket.new_key(tgt)
-        k.set_contents_from_filename(filename)
+            tgt = filename.rstrip('/').rsplit('/', 1)[-1]
+
+        files = [(filename, tgt)]
+        if os.path.isdir(filename):
+            files = []
+            for root, _, names in os.walk(filename):
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    key_name = os.path.relpath(path, filename).replace(os.sep, '/')
+                    files.append((path, tgt.rstrip('/') + '/' + key_name))
+
+        uploads = []
+        tasks = []
+        for path, key_name in files:
+            upload, upload_tasks = _plan_upload(self.bucket, path, key_name, self.part_size)
+            if upload is not None:
+                uploads.append(upload)
+            tasks.extend(upload_tasks)
+
+        errors = _run_parts(tasks, self.concurrency)
+        if errors:
+            raise Exception("%d parts failed to upload, call local_to_s3 again to resume: %s"
+                            % (len(errors), errors[0]))
+
+        for upload in uploads:
+            upload.complete_upload()
 
     def s3_to_local(self, src, tgt):
-        """Download the remote file `key_name` on S3 to local.
+        """Download the remote file or directory `src` on S3 to local.
+
+            Files are downloaded in parts, and the files of a directory
+            at once, by `concurrency` threads (see set_transfer_config).
+            If a download fails, calling this method again resumes it
+            unless the file on S3 has changed.
 
             Args:
-                src, tgt
+                src - an S3 file or directory
+                tgt - the local path of the file, or the local directory
+                      the files of the directory are saved under
             Returns:
                 None
         """
         if not self.bucket:
             raise Exception('no bucket is opened.')
 
-        key = src.strip()
-        if key[0] == '/':
-            key = key[1:]
-        k = self.bucket.get_key(key)
-        if not k:
-            raise Exception(
-                "File " + src + " doesn't exist.\n"
-                "Note that the transfer between S3 and local filesystem "
-                "do not support directory.")
-        k.get_contents_to_filename(tgt)
+        key_name = src.strip()
+        if key_name[0] == '/':
+            key_name = key_name[1:]
+
+        k = self.bucket.get_key(key_name)
+        if k:
+            files = [(k, tgt)]
+        else:
+            prefix = key_name.rstrip('/') + '/'
+            files = [(key, os.path.join(tgt, *key.name[len(prefix):].split('/')))
+                     for key in self.bucket.list(prefix=prefix)
+                     if not _is_directory(key.name)]
+        if not files:
+            raise Exception("File " + src + " doesn't exist.")
+
+        downloads = []
+        tasks = []
+        for key, path in files:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            download = _Download(key, path, self.part_size)
+            downloads.append(download)
+            tasks.extend(download.tasks(self.bucket_name))
+
+        errors = _run_parts(tasks, self.concurrency)
+        for download in downloads:
+            download.finish()
+        if errors:
+            raise Exception("%d parts failed to download, call s3_to_local again to resume: %s"
+                            % (len(errors), errors[0]))
 
     @staticmethod
     def local_to_hdfs(src, tgt):
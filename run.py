@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 
+import argparse
 import socket
 import sys
 import threading
 import webbrowser
 
+from spark_notebook.serving import KEEP_ALIVE
+from spark_notebook.serving import THREADS
+from spark_notebook.serving import serve
+
 debug = False
 
 
@@ -28,11 +33,51 @@ def get_available_port():
     return port
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Launch the Spark Notebook web interface.")
+    parser.add_argument("--production", action="store_true",
+                        help="serve with the multi-threaded production server instead of the "
+                             "Flask development server")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int,
+                        help="port to listen on (default: the first free port from 5000)")
+    parser.add_argument("--threads", type=int, default=THREADS,
+                        help="worker threads of the production server (default: %d)" % THREADS)
+    parser.add_argument("--keep-alive", type=int, default=KEEP_ALIVE,
+                        help="seconds an idle connection is kept open by the production server "
+                             "(default: %d)" % KEEP_ALIVE)
+    parser.add_argument("--no-browser", action="store_true",
+                        help="do not open a browser window")
+    parser.add_argument("--migrate-credentials", nargs=2, metavar=("YAML_PATH", "SQLITE_PATH"),
+                        help="copy the accounts of a YAML credentials file into a SQLite "
+                             "credentials database and exit")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
     from spark_notebook.server import app
+    from spark_notebook.server import load_config
+    from spark_notebook.server import start_pollers
+
+    args = parse_args()
+
+    if args.migrate_credentials:
+        from spark_notebook.credentials import migrate
+        print("Migrated %d accounts to %s" % (migrate(*args.migrate_credentials),
+                                              args.migrate_credentials[1]))
+        sys.exit(0)
 
     # Find an available port
-    port = get_available_port()
-    threading.Timer(
-        1, lambda: webbrowser.open("http://localhost:%d/" % port)).start()
-    app.run(port=port, debug=debug)
+    port = args.port or get_available_port()
+    start_pollers()
+    if not args.no_browser:
+        threading.Timer(
+            1, lambda: webbrowser.open("http://localhost:%d/" % port)).start()
+
+    if args.production:
+        # SIGHUP reloads the config and credentials files without a restart
+        serve(app, args.host, port, threads=args.threads, keep_alive=args.keep_alive,
+              reload=load_config)
+    else:
+        app.run(host=args.host, port=port, debug=debug)
@@ -1,11 +1,41 @@
-import boto3
 import botocore
 import botocore.exceptions
+import calendar
+import datetime
+import math
 import os
 import socket
 import time
+from spark_notebook.cloud.cache import cache
+from spark_notebook.cloud.client_pool import client_pool
+from spark_notebook.cloud.executor import executor
 from spark_notebook.exceptions import AWSException
 
+# Clusters that have not been terminated
+ACTIVE_CLUSTER_STATES = ["STARTING", "BOOTSTRAPPING", "RUNNING", "WAITING", "TERMINATING"]
+
+# Seconds to cache answers that do not change between requests
+ACCOUNT_ID_TTL = 3600
+S3_BUCKET_TTL = 600
+SUBNETS_TTL = 300
+
+# Most clusters terminated by a single terminate_job_flows call
+TERMINATE_BATCH_SIZE = 10
+
+# Minutes an instance fleet waits for spot capacity before it launches on-demand instances,
+# and the range EMR accepts
+SPOT_TIMEOUT = 10
+MIN_SPOT_TIMEOUT = 5
+MAX_SPOT_TIMEOUT = 1440
+
+# Most instance types EMR accepts in one instance fleet
+MAX_FLEET_INSTANCE_TYPES = 5
+
+# Seconds between the IsIdle datapoints EMR sends to CloudWatch, and the most datapoints one
+# get_metric_statistics call returns
+IDLE_METRIC_PERIOD = 300
+MAX_METRIC_DATAPOINTS = 1440
+
 
 class AWS:
 
@@ -16,12 +46,20 @@ class AWS:
         self.key_name = None
         self.identity_file = None
 
+    def _client(self, service_name):
+        return client_pool.get(service_name, self.access_key_id, self.secret_access_key,
+                               self.region_name)
+
+    def _cache_key(self, *args):
+        return (self.access_key_id, self.region_name) + args
+
+    def invalidate_cache(self):
+        # Forget every cached answer for these credentials and region
+        cache.invalidate(lambda key: key[:2] == (self.access_key_id, self.region_name))
+
     def test_credentials(self):
         try:
-            boto3.client('sts',
-                         aws_access_key_id=self.access_key_id,
-                         aws_secret_access_key=self.secret_access_key,
-                         region_name=self.region_name).get_caller_identity()['Arn']
+            self._client('sts').get_caller_identity()['Arn']
         except botocore.exceptions.ClientError as e:
             if e.response["Error"]["Code"] == "AuthFailure" or \
                     e.response["Error"]["Code"] == "InvalidClientTokenId":
@@ -36,10 +74,7 @@ class AWS:
         self.identity_file = identity_file
 
         try:
-            client = boto3.client('ec2',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('ec2')
         except botocore.exceptions.ClientError as e:
             if e.response["Error"]["Code"] == "AuthFailure":
                 raise AWSException("Invalid AWS access key id or aws secret access key")
@@ -64,10 +99,7 @@ class AWS:
 
     def create_ssh_key(self, email_address, file_path):
         try:
-            client = boto3.client('ec2',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('ec2')
         except Exception as e:
             raise AWSException("There was an error connecting to EC2: %s" % e)
 
@@ -95,45 +127,68 @@ class AWS:
         if not os.path.isfile(self.identity_file):
             raise AWSException("SSH key %s not saved" % self.identity_file)
 
-    def get_subnets(self):
-        try:
-            client = boto3.client('ec2',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
-        except Exception as e:
-            raise AWSException("There was an error connecting to EC2: %s" % e)
+    def get_subnets(self, vpc_id=None, tags=None):
+        # The subnets of the account are cached sorted by availability zone and filtered here,
+        # so only the first call in SUBNETS_TTL seconds goes to EC2
+        subnets = self.get_cached_subnets()
+
+        if subnets is None:
+            try:
+                client = self._client('ec2')
+            except Exception as e:
+                raise AWSException("There was an error connecting to EC2: %s" % e)
+
+            # Search EC2 for the VPC subnets
+            try:
+                subnets = client.describe_subnets()["Subnets"]
+            except botocore.exceptions.ClientError as e:
+                raise AWSException("There was an error describing the VPC Subnets: %s" %
+                                   e.response["Error"]["Message"])
+            except botocore.exceptions.ParamValidationError as e:
+                raise AWSException("There was an error describing the VPC Subnets: %s" % e)
 
-        # Search EC2 for the VPC subnets
-        try:
-            return client.describe_subnets()
-        except botocore.exceptions.ClientError as e:
-            raise AWSException("There was an error describing the VPC Subnets: %s" %
-                               e.response["Error"]["Message"])
-        except botocore.exceptions.ParamValidationError as e:
-            raise AWSException("There was an error describing the VPC Subnets: %s" % e)
+            subnets = sorted(subnets, key=lambda k: k["AvailabilityZone"])
+            cache.set(self._cache_key("subnets"), subnets, SUBNETS_TTL)
+
+        if vpc_id is not None:
+            subnets = [subnet for subnet in subnets if subnet.get("VpcId") == vpc_id]
+        if tags:
+            subnets = [subnet for subnet in subnets if _has_tags(subnet, tags)]
+
+        return {"Subnets": subnets}
+
+    def get_cached_subnets(self):
+        # Return the cached subnets without calling EC2, or None if they are not cached
+        return cache.get(self._cache_key("subnets"))
 
     def get_account_id(self):
+        cache_key = self._cache_key("account_id")
+        account_id = cache.get(cache_key)
+        if account_id is not None:
+            return account_id
+
         try:
-            client = boto3.client('sts',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('sts')
         except Exception as e:
             raise AWSException("There was an error connecting to EC2: %s" % e)
 
         try:
-            return client.get_caller_identity()["Account"]
+            account_id = client.get_caller_identity()["Account"]
         except botocore.exceptions.ClientError as e:
             raise AWSException("There was an error getting the Account ID: %s" %
                                e.response["Error"]["Message"])
 
+        cache.set(cache_key, account_id, ACCOUNT_ID_TTL)
+        return account_id
+
     def head_s3_bucket(self, bucket_name):
+        # Only successful checks are cached so a missing bucket is reported until it is created
+        cache_key = self._cache_key("head_s3_bucket", bucket_name)
+        if cache.get(cache_key):
+            return
+
         try:
-            client = boto3.client('s3',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('s3')
         except Exception as e:
             raise AWSException("There was an error connecting to S3: %s" % e)
 
@@ -143,135 +198,80 @@ class AWS:
             raise AWSException("There was an error getting the S3 bucket information (%s): %s" %
                                (bucket_name, e.response["Error"]["Message"]))
 
+        cache.set(cache_key, True, S3_BUCKET_TTL)
+
     def create_cluster(self, cluster_name, key_name, instance_type, worker_count, ec2_subnet_id,
                        instance_market, bid_price, user_bootstrap_path, pyspark_python_version,
                        tags, jupyter_password):
-        # Latest known working version of EMR
-        version = "emr-5.13.0"
-
-        # Create the log_uri from the AWS account id and region_name
-        log_uri = "s3://aws-logs-%s-%s/elasticmapreduce/" % \
-                  (self.get_account_id(), self.region_name)
+        # Kept for callers of the original API. Launching goes through build_launch_template and
+        # launch_cluster or launch_clusters, which is what the app uses.
+        launch_template = build_launch_template(instance_type, worker_count, instance_market,
+                                                bid_price, user_bootstrap_path,
+                                                pyspark_python_version, jupyter_password)
+        return self.launch_cluster(launch_template, cluster_name, key_name, ec2_subnet_id, tags)
+
+    def launch_cluster(self, launch_template, cluster_name, key_name, ec2_subnet_id, tags):
+        # Launch a cluster from a payload built by build_launch_template
+        return self.run_job_flow(self.fill_launch_template(launch_template, cluster_name,
+                                                           key_name, ec2_subnet_id, tags))
+
+    def launch_clusters(self, launch_template, count, name_template, key_name, ec2_subnet_id,
+                        tags):
+        # Launch count identical clusters named from name_template, e.g. "workshop-{index}".
+        # The run_job_flow payload is filled in once and the launches are submitted
+        # concurrently. Returns the launched job flow ids and the errors of the launches that
+        # failed.
+        job_flow = self.fill_launch_template(launch_template, name_template, key_name,
+                                             ec2_subnet_id, tags)
+
+        if "{index}" not in name_template:
+            name_template += "-{index}"
+
+        futures = []
+        for index in range(1, int(count) + 1):
+            cluster_job_flow = dict(job_flow, Name=name_template.replace("{index}", str(index)))
+            futures.append(executor.submit(self.run_job_flow, cluster_job_flow))
+
+        job_flow_ids = []
+        errors = []
+        for future in futures:
+            try:
+                job_flow_ids.append(future.result())
+            except AWSException as e:
+                errors.append(e.msg)
+
+        return job_flow_ids, errors
+
+    def fill_launch_template(self, launch_template, cluster_name, key_name, ec2_subnet_id, tags):
+        # Add the settings of this account and launch to a payload built by
+        # build_launch_template. The template itself is left untouched so it can be reused.
 
         # Fail if an ec2_subnet_id is not specified
         if ec2_subnet_id is None:
             raise AWSException("Subnet not specified")
 
-        # Describe the compute instance groups
-        if instance_market:
-            market = "SPOT"
-        else:
-            market = "ON_DEMAND"
-
-        master_instance_group = {'Name': "Master nodes",
-                                 'Market': market,
-                                 'InstanceRole': 'MASTER',
-                                 'InstanceType': instance_type,
-                                 'InstanceCount': 1,
-                                 }
-
-        core_instance_group = {'Name': "Core nodes",
-                               'Market': market,
-                               'InstanceRole': 'CORE',
-                               'InstanceType': instance_type,
-                               'InstanceCount': int(worker_count),
-                               }
-
-        if instance_market:
-            master_instance_group["BidPrice"] = str(bid_price)
-            core_instance_group["BidPrice"] = str(bid_price)
-
-        if pyspark_python_version == "3":
-            pyspark_python_3 = [
-                {
-                    "Classification": "spark-env",
-                    "Configurations": [
-                        {
-                            "Classification": "export",
-                            "Properties": {
-                                "PYSPARK_PYTHON": "/usr/bin/python3",
-                                "PYSPARK_DRIVER_PYTHON": "/usr/bin/python3"
-                            }
-                        }
-                    ]
-                },
-                {
-                    "Classification": "spark-defaults",
-                    "Properties": {
-                        "spark.yarn.appMasterEnv.PYSPARK_PYTHON": "/usr/bin/python3",
-                        "spark.executorEnv.PYSPARK_PYTHON": "/usr/bin/python3"
-                    }
-                }
-            ]
-            master_instance_group["Configurations"] = pyspark_python_3
-            core_instance_group["Configurations"] = pyspark_python_3
-
-        instance_groups = [master_instance_group, core_instance_group]
+        # Create the log_uri from the AWS account id and region_name
+        log_uri = "s3://aws-logs-%s-%s/elasticmapreduce/" % \
+                  (self.get_account_id(), self.region_name)
 
-        # Describe the bootstrap actions
-        bootstrap_actions = []
+        instances = dict(launch_template["Instances"],
+                         Ec2KeyName=key_name,
+                         Ec2SubnetId=ec2_subnet_id)
 
-        # Default bootstrap action that is always used
-        juypter_bootstrap_action = {
-            'Name': 'jupyter-provision',
-            'ScriptBootstrapAction': {
-                'Path': 's3://mas-dse-emr/jupyter-provision-v0.4.5.sh',
-                'Args': [
-                    jupyter_password,
-                    pyspark_python_version,
-                ]
-            }
-        }
-        bootstrap_actions.append(juypter_bootstrap_action)
-
-        # User provided bootstrap actions
-        if user_bootstrap_path is not None:
-            user_bootstrap_action = {
-                'Name': 'user-bootstrap-01',
-                'ScriptBootstrapAction': {
-                    'Path': user_bootstrap_path,
-                    'Args': []
-                }
-            }
-            bootstrap_actions.append(user_bootstrap_action)
+        return dict(launch_template,
+                    Name=cluster_name,
+                    LogUri=log_uri,
+                    Instances=instances,
+                    Tags=tags)
 
+    def run_job_flow(self, job_flow):
         try:
-            client = boto3.client('emr',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('emr')
         except Exception as e:
             raise AWSException("There was an error connecting to EMR: %s" % e)
 
-        # TODO: Make Core instance roles optional so a cluster can be launched with only a master
-        # TODO: Add option to set EBS volume size
         try:
-            response = client.run_job_flow(
-                Name=cluster_name,
-                LogUri=log_uri,
-                ReleaseLabel=version,
-                VisibleToAllUsers=True,
-                JobFlowRole='EMR_EC2_DefaultRole',
-                ServiceRole='EMR_DefaultRole',
-                Applications=[
-                    {
-                        'Name': 'Hadoop'
-                    },
-                    {
-                        'Name': 'Spark'
-                    }
-                ],
-                Instances={
-                    'Ec2KeyName': key_name,
-                    'KeepJobFlowAliveWhenNoSteps': True,
-                    'TerminationProtected': False,
-                    'Ec2SubnetId': ec2_subnet_id,
-                    'InstanceGroups': instance_groups,
-                },
-                Steps=[],
-                BootstrapActions=bootstrap_actions,
-                Tags=tags
-            )
+            response = client.run_job_flow(**job_flow)
 
             return response['JobFlowId']
 
@@ -284,34 +284,60 @@ class AWS:
         except Exception as e:
             raise AWSException("Unknown Error: %s" % e)
 
-    def list_clusters(self):
+    def list_clusters_page(self, states=None, created_after=None, created_before=None,
+                           marker=None):
+        # Return a single page of cluster summaries and the marker of the next page, if any
         try:
-            client = boto3.client('emr',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('emr')
         except Exception as e:
             raise AWSException("There was an error connecting to EMR: %s" % e)
 
+        kwargs = dict()
+        if states:
+            kwargs["ClusterStates"] = list(states)
+        if created_after is not None:
+            kwargs["CreatedAfter"] = created_after
+        if created_before is not None:
+            kwargs["CreatedBefore"] = created_before
+        if marker is not None:
+            kwargs["Marker"] = marker
+
         try:
-            cluster_list = client.list_clusters()
+            response = client.list_clusters(**kwargs)
         except botocore.exceptions.ClientError as e:
             if e.response["Error"]["Code"] == "AuthFailure":
                 raise AWSException("Invalid AWS access key id or aws secret access key")
             else:
-                raise AWSException("There was an error creating a new EMR cluster: %s" %
+                raise AWSException("There was an error listing the EMR clusters: %s" %
                                    e.response["Error"]["Message"])
         except Exception as e:
             raise AWSException("Unknown Error: %s" % e)
 
-        return cluster_list
+        return response.get("Clusters", []), response.get("Marker")
+
+    def iter_clusters(self, states=None, created_after=None, created_before=None, limit=None):
+        # Yield cluster summaries page by page, following the Marker until there are no more
+        # pages or limit clusters have been yielded
+        count = 0
+        marker = None
+        while True:
+            clusters, marker = self.list_clusters_page(states, created_after, created_before,
+                                                       marker)
+            for cluster in clusters:
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield cluster
+            if marker is None or (limit is not None and count >= limit):
+                return
+
+    def list_clusters(self, states=None, created_after=None, created_before=None, limit=None):
+        return {"Clusters": list(self.iter_clusters(states, created_after, created_before,
+                                                    limit))}
 
     def describe_cluster(self, cluster_id):
         try:
-            client = boto3.client('emr',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('emr')
         except Exception as e:
             raise AWSException("There was an error connecting to EMR: %s" % e)
 
@@ -328,10 +354,7 @@ class AWS:
 
     def list_bootstrap_actions(self, cluster_id):
         try:
-            client = boto3.client('emr',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('emr')
         except Exception as e:
             raise AWSException("There was an error connecting to EMR: %s" % e)
 
@@ -347,16 +370,17 @@ class AWS:
             raise AWSException("Unknown Error: %s" % e)
 
     def terminate_cluster(self, cluster_id):
+        self.terminate_clusters([cluster_id])
+
+    def terminate_clusters(self, cluster_ids):
         try:
-            client = boto3.client('emr',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('emr')
         except Exception as e:
             raise AWSException("There was an error connecting to EMR: %s" % e)
 
         try:
-            client.terminate_job_flows(JobFlowIds=[cluster_id])
+            for i in range(0, len(cluster_ids), TERMINATE_BATCH_SIZE):
+                client.terminate_job_flows(JobFlowIds=list(cluster_ids[i:i + TERMINATE_BATCH_SIZE]))
         except botocore.exceptions.ClientError as e:
             if e.response["Error"]["Code"] == "AuthFailure":
                 raise AWSException("Invalid AWS access key id or aws secret access key")
@@ -366,12 +390,79 @@ class AWS:
         except Exception as e:
             raise AWSException("Unknown Error: %s" % e)
 
+    def is_idle(self, cluster_id, idle_seconds):
+        # Whether EMR reported the cluster idle during all of the last idle_seconds
+        try:
+            client = self._client('cloudwatch')
+        except Exception as e:
+            raise AWSException("There was an error connecting to CloudWatch: %s" % e)
+
+        # Longer windows are covered with longer periods, as the number of datapoints is limited
+        period = IDLE_METRIC_PERIOD * int(math.ceil(
+            idle_seconds / float(IDLE_METRIC_PERIOD * MAX_METRIC_DATAPOINTS)))
+        end_time = datetime.datetime.utcfromtimestamp(time.time())
+        try:
+            datapoints = client.get_metric_statistics(
+                Namespace="AWS/ElasticMapReduce",
+                MetricName="IsIdle",
+                Dimensions=[{"Name": "JobFlowId", "Value": cluster_id}],
+                StartTime=end_time - datetime.timedelta(seconds=idle_seconds),
+                EndTime=end_time,
+                Period=max(period, IDLE_METRIC_PERIOD),
+                Statistics=["Minimum"])["Datapoints"]
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] == "AuthFailure":
+                raise AWSException("Invalid AWS access key id or aws secret access key")
+            else:
+                raise AWSException("There was an error reading the EMR cluster metrics: %s" %
+                                   e.response["Error"]["Message"])
+        except Exception as e:
+            raise AWSException("Unknown Error: %s" % e)
+
+        return len(datapoints) > 0 and all(d["Minimum"] >= 1 for d in datapoints)
+
+    def find_idle_clusters(self, idle_seconds, owner=None):
+        # Return the ids of the clusters launched by spark-notebook that have been idle for more
+        # than idle_seconds. Clusters are recognized by their "cluster" tag, which holds the
+        # email address of the account that launched them and must match owner if given.
+        # They run no steps and are WAITING for as long as they are up, so idleness is read from
+        # the IsIdle metric EMR sends to CloudWatch, which is 0 while a YARN application, e.g.
+        # the Spark context of a notebook, is running.
+        # Clusters that cannot be described, e.g. because they terminated since they were
+        # listed, are left out.
+        now = time.time()
+        candidates = []
+        for cluster in self.iter_clusters(states=["WAITING"]):
+            timeline = cluster["Status"].get("Timeline", {})
+            ready = timeline.get("ReadyDateTime") or timeline.get("CreationDateTime")
+            if ready is not None and now - _timestamp(ready) > idle_seconds:
+                candidates.append(cluster["Id"])
+
+        owned = []
+        futures = [executor.submit(self.describe_cluster, cluster_id) for cluster_id in candidates]
+        for cluster_id, future in zip(candidates, futures):
+            try:
+                description = future.result()
+            except AWSException:
+                continue
+            tags = _tag_dict(description["Cluster"])
+            if "cluster" in tags and (owner is None or tags["cluster"] == owner):
+                owned.append(cluster_id)
+
+        idle_cluster_ids = []
+        futures = [executor.submit(self.is_idle, cluster_id, idle_seconds) for cluster_id in owned]
+        for cluster_id, future in zip(owned, futures):
+            try:
+                if future.result():
+                    idle_cluster_ids.append(cluster_id)
+            except AWSException:
+                continue
+
+        return idle_cluster_ids
+
     def get_security_group_port_open(self, security_group_id, port):
         try:
-            client = boto3.client('ec2',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('ec2')
         except Exception as e:
             raise AWSException("There was an error connecting to EC2: %s" % e)
 
@@ -389,10 +480,7 @@ class AWS:
 
     def authorize_security_group_ingress(self, security_group_id, port, description):
         try:
-            client = boto3.client('ec2',
-                                  aws_access_key_id=self.access_key_id,
-                                  aws_secret_access_key=self.secret_access_key,
-                                  region_name=self.region_name)
+            client = self._client('ec2')
         except Exception as e:
             raise AWSException("There was an error connecting to EC2: %s" % e)
 
@@ -411,3 +499,262 @@ class AWS:
         except botocore.exceptions.ClientError as e:
             raise AWSException("There was an error updating the security group: %s" %
                                e.response["Error"]["Message"])
+
+    def open_security_group_ports(self, security_group_id, ports):
+        # Open every (port, description) in ports that is not already open in the security group.
+        # The group is described once and all of the missing ports are authorized in one request.
+        try:
+            client = self._client('ec2')
+        except Exception as e:
+            raise AWSException("There was an error connecting to EC2: %s" % e)
+
+        try:
+            response = client.describe_security_groups(GroupIds=[security_group_id])
+        except botocore.exceptions.ClientError as e:
+            raise AWSException("There was an error describing the security group: %s" %
+                               e.response["Error"]["Message"])
+
+        # Index the (protocol, from port, to port) ranges of the security group that are open to
+        # everyone. Rules whose source is another security group, like the "All TCP" rule
+        # between the master and the slaves of EMR, leave the ports closed to the notebook.
+        open_ranges = set()
+        for ip_permission in response["SecurityGroups"][0]["IpPermissions"]:
+            if any(ip_range.get("CidrIp") == "0.0.0.0/0"
+                   for ip_range in ip_permission.get("IpRanges", [])):
+                open_ranges.add((ip_permission["IpProtocol"],
+                                 ip_permission.get("FromPort"),
+                                 ip_permission.get("ToPort")))
+
+        ip_permissions = []
+        for port, description in ports:
+            if not _port_in_ranges(open_ranges, port):
+                ip_permissions.append({'IpProtocol': 'tcp',
+                                       'FromPort': port,
+                                       'ToPort': port,
+                                       'IpRanges': [{'CidrIp': '0.0.0.0/0',
+                                                     'Description': description}]})
+
+        if not ip_permissions:
+            return []
+
+        try:
+            client.authorize_security_group_ingress(GroupId=security_group_id,
+                                                    IpPermissions=ip_permissions)
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "InvalidPermission.Duplicate":
+                raise AWSException("There was an error updating the security group: %s" %
+                                   e.response["Error"]["Message"])
+            # Another request opened some of the ports since the group was described, and EC2
+            # rejects the whole request. Open the ports one at a time, skipping those.
+            opened = []
+            for ip_permission in ip_permissions:
+                try:
+                    client.authorize_security_group_ingress(GroupId=security_group_id,
+                                                            IpPermissions=[ip_permission])
+                    opened.append(ip_permission["FromPort"])
+                except botocore.exceptions.ClientError as e:
+                    if e.response["Error"]["Code"] != "InvalidPermission.Duplicate":
+                        raise AWSException("There was an error updating the security group: %s"
+                                           % e.response["Error"]["Message"])
+            return opened
+
+        return [ip_permission["FromPort"] for ip_permission in ip_permissions]
+
+
+def build_launch_template(instance_type, worker_count, instance_market, bid_price,
+                          user_bootstrap_path, pyspark_python_version, jupyter_password,
+                          instance_types=None, spot_timeout=SPOT_TIMEOUT):
+    # Build the parts of a run_job_flow request that do not depend on the account or the
+    # launch: the instance groups, the PySpark configuration and the bootstrap actions.
+    # AWS.fill_launch_template adds the rest.
+    #
+    # If instance_types lists other (instance type, weighted capacity) pairs besides
+    # instance_type, the cluster is launched with instance fleets instead of instance groups.
+    # EMR then picks whichever type has capacity, worker_count becomes the capacity of the core
+    # fleet and spot fleets switch to on-demand instances after spot_timeout minutes.
+
+    # Latest known working version of EMR
+    version = "emr-5.13.0"
+
+    configurations = None
+    if pyspark_python_version == "3":
+        configurations = [
+            {
+                "Classification": "spark-env",
+                "Configurations": [
+                    {
+                        "Classification": "export",
+                        "Properties": {
+                            "PYSPARK_PYTHON": "/usr/bin/python3",
+                            "PYSPARK_DRIVER_PYTHON": "/usr/bin/python3"
+                        }
+                    }
+                ]
+            },
+            {
+                "Classification": "spark-defaults",
+                "Properties": {
+                    "spark.yarn.appMasterEnv.PYSPARK_PYTHON": "/usr/bin/python3",
+                    "spark.executorEnv.PYSPARK_PYTHON": "/usr/bin/python3"
+                }
+            }
+        ]
+
+    if instance_types:
+        instances = {'InstanceFleets': _instance_fleets(
+            [(instance_type, 1)] + list(instance_types), worker_count, instance_market,
+            bid_price, spot_timeout, configurations)}
+    else:
+        instances = {'InstanceGroups': _instance_groups(
+            instance_type, worker_count, instance_market, bid_price, configurations)}
+
+    # Describe the bootstrap actions
+    bootstrap_actions = []
+
+    # Default bootstrap action that is always used
+    juypter_bootstrap_action = {
+        'Name': 'jupyter-provision',
+        'ScriptBootstrapAction': {
+            'Path': 's3://mas-dse-emr/jupyter-provision-v0.4.5.sh',
+            'Args': [
+                jupyter_password,
+                pyspark_python_version,
+            ]
+        }
+    }
+    bootstrap_actions.append(juypter_bootstrap_action)
+
+    # User provided bootstrap actions
+    if user_bootstrap_path is not None:
+        user_bootstrap_action = {
+            'Name': 'user-bootstrap-01',
+            'ScriptBootstrapAction': {
+                'Path': user_bootstrap_path,
+                'Args': []
+            }
+        }
+        bootstrap_actions.append(user_bootstrap_action)
+
+    # TODO: Make Core instance roles optional so a cluster can be launched with only a master
+    # TODO: Add option to set EBS volume size
+    return dict(
+        ReleaseLabel=version,
+        VisibleToAllUsers=True,
+        JobFlowRole='EMR_EC2_DefaultRole',
+        ServiceRole='EMR_DefaultRole',
+        Applications=[
+            {
+                'Name': 'Hadoop'
+            },
+            {
+                'Name': 'Spark'
+            }
+        ],
+        Instances=dict(instances,
+                       KeepJobFlowAliveWhenNoSteps=True,
+                       TerminationProtected=False),
+        Steps=[],
+        BootstrapActions=bootstrap_actions
+    )
+
+
+def _instance_groups(instance_type, worker_count, instance_market, bid_price, configurations):
+    # Describe the compute instance groups
+    if instance_market:
+        market = "SPOT"
+    else:
+        market = "ON_DEMAND"
+
+    master_instance_group = {'Name': "Master nodes",
+                             'Market': market,
+                             'InstanceRole': 'MASTER',
+                             'InstanceType': instance_type,
+                             'InstanceCount': 1,
+                             }
+
+    core_instance_group = {'Name': "Core nodes",
+                           'Market': market,
+                           'InstanceRole': 'CORE',
+                           'InstanceType': instance_type,
+                           'InstanceCount': int(worker_count),
+                           }
+
+    if instance_market:
+        master_instance_group["BidPrice"] = str(bid_price)
+        core_instance_group["BidPrice"] = str(bid_price)
+
+    if configurations is not None:
+        master_instance_group["Configurations"] = configurations
+        core_instance_group["Configurations"] = configurations
+
+    return [master_instance_group, core_instance_group]
+
+
+def _instance_fleets(instance_types, worker_count, instance_market, bid_price, spot_timeout,
+                     configurations):
+    # Describe the master and core instance fleets. instance_types is a list of
+    # (instance type, weighted capacity) pairs. bid_price is the price of one unit of capacity,
+    # so the bid for each type is scaled by its weight.
+    if len(instance_types) > MAX_FLEET_INSTANCE_TYPES:
+        raise AWSException("An instance fleet can have at most %d instance types" %
+                           MAX_FLEET_INSTANCE_TYPES)
+    if instance_market and not MIN_SPOT_TIMEOUT <= int(spot_timeout) <= MAX_SPOT_TIMEOUT:
+        raise AWSException("The spot timeout must be between %d and %d minutes" %
+                           (MIN_SPOT_TIMEOUT, MAX_SPOT_TIMEOUT))
+
+    fleets = []
+    for name, role, capacity in [("Master nodes", "MASTER", 1),
+                                 ("Core nodes", "CORE", int(worker_count))]:
+        instance_type_configs = []
+        for instance_type, weight in instance_types:
+            instance_type_config = {'InstanceType': instance_type,
+                                    # The master fleet always has a single instance
+                                    'WeightedCapacity': int(weight) if role == "CORE" else 1}
+            if instance_market:
+                instance_type_config['BidPrice'] = str(round(float(bid_price) * int(weight), 4))
+            if configurations is not None:
+                instance_type_config['Configurations'] = configurations
+            instance_type_configs.append(instance_type_config)
+
+        fleet = {'Name': name,
+                 'InstanceFleetType': role,
+                 'InstanceTypeConfigs': instance_type_configs}
+        if instance_market:
+            fleet['TargetSpotCapacity'] = capacity
+            fleet['LaunchSpecifications'] = {
+                'SpotSpecification': {'TimeoutDurationMinutes': int(spot_timeout),
+                                      'TimeoutAction': 'SWITCH_TO_ON_DEMAND'}}
+        else:
+            fleet['TargetOnDemandCapacity'] = capacity
+        fleets.append(fleet)
+
+    return fleets
+
+
+def _timestamp(value):
+    # boto3 returns timezone aware datetimes
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return value
+
+
+def _tag_dict(resource):
+    return dict((tag["Key"], tag["Value"]) for tag in resource.get("Tags", []))
+
+
+def _has_tags(resource, tags):
+    resource_tags = _tag_dict(resource)
+    for key, value in tags.items():
+        if resource_tags.get(key) != value:
+            return False
+    return True
+
+
+def _port_in_ranges(open_ranges, port):
+    for protocol, from_port, to_port in open_ranges:
+        # All traffic rules ("-1") have no port range
+        if protocol == "-1":
+            return True
+        if protocol == "tcp" and from_port <= port <= to_port:
+            return True
+    return False
@@ -0,0 +1,67 @@
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+from spark_notebook.cloud.aws import AWS
+
+# Threads shared by every AsyncAWS. boto3 is blocking, so each call in flight holds a thread.
+async_executor = ThreadPoolExecutor(max_workers=64)
+
+
+class AsyncAWS:
+    """asyncio front end to AWS.
+
+    Every public method of AWS is generated on this class by _add_methods. It returns an awaitable
+    that runs the matching AWS method on `async_executor`, so a single event loop can drive many
+    describe and list calls at once. The calls go through the same pooled, rate limited clients
+    as AWS.
+    """
+
+    def __init__(self, access_key_id, secret_access_key, region_name, loop=None, executor=None):
+        self.aws = AWS(access_key_id, secret_access_key, region_name)
+        self.loop = loop
+        self.executor = executor or async_executor
+
+    @property
+    def region_name(self):
+        return self.aws.region_name
+
+    def _run(self, method, *args, **kwargs):
+        loop = self.loop or asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+
+def _wrap(name, method):
+    # An AsyncAWS method that runs the AWS method `name`. Generators are run to the end, so their
+    # AWS calls are made on the executor too, and their items are returned as a list.
+    if inspect.isgeneratorfunction(method):
+        def call(self, *args, **kwargs):
+            return self._run(lambda: list(getattr(self.aws, name)(*args, **kwargs)))
+    else:
+        def call(self, *args, **kwargs):
+            return self._run(getattr(self.aws, name), *args, **kwargs)
+    return functools.wraps(method)(call)
+
+
+def _add_methods():
+    # Give AsyncAWS every public method of AWS, so the two cannot drift apart
+    for name, method in inspect.getmembers(AWS, inspect.isfunction):
+        if not name.startswith("_") and not hasattr(AsyncAWS, name):
+            setattr(AsyncAWS, name, _wrap(name, method))
+
+
+_add_methods()
+
+
+def describe_clusters(cloud_account, cluster_ids):
+    # Describe many clusters of one account concurrently
+    return asyncio.gather(*[cloud_account.describe_cluster(cluster_id)
+                            for cluster_id in cluster_ids])
+
+
+def list_clusters(cloud_accounts, states=None):
+    # List the clusters of many accounts concurrently. Failures are returned in place of the
+    # cluster list of the account instead of cancelling the other calls.
+    return asyncio.gather(*[cloud_account.list_clusters(states=states)
+                            for cloud_account in cloud_accounts], return_exceptions=True)
@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe, process wide key/value cache whose entries expire after a time to live."""
+
+    def __init__(self, ttl=300, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                value, expires = self._entries[key]
+                if self.clock() < expires:
+                    return value
+                del self._entries[key]
+        return default
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (value, self.clock() + ttl)
+
+    def invalidate(self, predicate=None):
+        # Drop every entry whose key matches the predicate, or all of them if there is none
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if predicate(key)]:
+                    del self._entries[key]
+
+    def clear(self):
+        self.invalidate()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = TTLCache()
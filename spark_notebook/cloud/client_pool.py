@@ -0,0 +1,69 @@
+import threading
+import time
+
+import boto3
+import botocore.config
+
+from spark_notebook.cloud.throttle import ThrottledClient
+from spark_notebook.cloud.throttle import buckets
+
+# botocore retries throttled calls on its own by default. ThrottledClient is the only retry
+# policy, so the clients make a single attempt and every attempt is counted in its stats.
+CLIENT_CONFIG = botocore.config.Config(retries={'max_attempts': 0})
+
+
+class ClientPool:
+    """Process wide pool of boto3 clients.
+
+    Clients are keyed by (access key id, secret access key, region, service) and reused across
+    requests. boto3 clients are thread-safe once built, but building them from the default session
+    is not, so construction happens under the pool lock. Clients that have not been used for
+    `max_idle` seconds are evicted on the next lookup.
+
+    Every client is wrapped in a ThrottledClient sharing the token bucket of its access key and
+    region, so all calls made with the same credentials are rate limited and retried together.
+    """
+
+    def __init__(self, max_idle=600, clock=time.time):
+        self.max_idle = max_idle
+        self.clock = clock
+        self._clients = dict()
+        self._lock = threading.Lock()
+
+    def get(self, service_name, access_key_id, secret_access_key, region_name):
+        key = (access_key_id, secret_access_key, region_name, service_name)
+        now = self.clock()
+
+        with self._lock:
+            self._evict(now)
+
+            if key in self._clients:
+                client = self._clients[key][0]
+            else:
+                client = ThrottledClient(boto3.client(service_name,
+                                                      aws_access_key_id=access_key_id,
+                                                      aws_secret_access_key=secret_access_key,
+                                                      region_name=region_name,
+                                                      config=CLIENT_CONFIG),
+                                         buckets.get(access_key_id, region_name))
+            self._clients[key] = (client, now)
+
+        return client
+
+    def clear(self):
+        # Drop every pooled client along with the rate limits of their credentials
+        with self._lock:
+            self._clients.clear()
+            buckets.clear()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _evict(self, now):
+        expired = [key for key, (_, last_used) in self._clients.items()
+                   if now - last_used > self.max_idle]
+        for key in expired:
+            del self._clients[key]
+
+
+client_pool = ClientPool()
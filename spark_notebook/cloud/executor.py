@@ -0,0 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared, bounded pool for fanning out independent AWS API calls from a single request
+executor = ThreadPoolExecutor(max_workers=16)
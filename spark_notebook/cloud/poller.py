@@ -0,0 +1,325 @@
+import threading
+import time
+
+from spark_notebook.cloud.aws import ACTIVE_CLUSTER_STATES
+from spark_notebook.exceptions import AWSException
+
+# Seconds between polls while a cluster is changing state and while every cluster is settled
+FAST_INTERVAL = 10
+SLOW_INTERVAL = 120
+
+# Seconds between sweeps for idle clusters
+SWEEP_INTERVAL = 600
+
+# Clusters in these states are expected to change soon
+TRANSITIONAL_STATES = ["STARTING", "BOOTSTRAPPING", "TERMINATING"]
+
+
+class ClusterPoller(threading.Thread):
+    """Background thread that keeps an in-memory snapshot of one account's clusters and subnets.
+
+    The snapshot is a dict that is replaced as a whole after every poll, so readers never see a
+    partially updated one. The poll interval drops to `fast_interval` while any cluster is in a
+    transitional state and rises to `slow_interval` otherwise.
+    """
+
+    def __init__(self, cloud_account, fast_interval=FAST_INTERVAL, slow_interval=SLOW_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.cloud_account = cloud_account
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.snapshot = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        # Serializes the polls of the thread with those of the views, see PollerRegistry.poll
+        self._poll_lock = threading.Lock()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.poll()
+            self._wake.wait(self.interval())
+            self._wake.clear()
+
+    def interval(self):
+        if self.snapshot is not None:
+            for cluster in self.snapshot["clusters"]["Clusters"]:
+                if cluster["Status"]["State"] in TRANSITIONAL_STATES:
+                    return self.fast_interval
+        return self.slow_interval
+
+    def poll(self):
+        with self._poll_lock:
+            self._poll()
+
+    def _poll(self):
+        previous = self.snapshot
+        now = time.time()
+        snapshot = dict(clusters={"Clusters": []}, subnets=None, subnets_updated=0,
+                        updated=now, error=None)
+        if previous is not None:
+            snapshot.update(clusters=previous["clusters"], subnets=previous["subnets"],
+                            subnets_updated=previous["subnets_updated"])
+
+        try:
+            snapshot["clusters"] = self.cloud_account.list_clusters(states=ACTIVE_CLUSTER_STATES)
+
+            # Subnets rarely change so they are only refreshed at the slow interval
+            if snapshot["subnets"] is None or \
+                    now - snapshot["subnets_updated"] >= self.slow_interval:
+                snapshot["subnets"] = self.cloud_account.get_subnets()
+                snapshot["subnets_updated"] = now
+        except AWSException as e:
+            snapshot["error"] = e.msg
+        except Exception as e:
+            # Errors botocore raises outside of ClientError, like EndpointConnectionError, must
+            # not end the thread either
+            snapshot["error"] = "There was an error polling the clusters: %s" % e
+
+        self.snapshot = snapshot
+
+    def refresh(self):
+        # Poll again now instead of waiting for the current interval to finish
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+
+def _identity(cloud_account):
+    return (cloud_account.access_key_id, cloud_account.secret_access_key,
+            cloud_account.region_name)
+
+
+class PollerRegistry:
+    """The cluster pollers of every account, keyed by account name."""
+
+    def __init__(self):
+        # Accounts added later are only polled once polling has been enabled
+        self.enabled = False
+        self._pollers = dict()
+        self._lock = threading.Lock()
+
+    def add(self, account, cloud_account):
+        with self._lock:
+            if account in self._pollers:
+                self._pollers[account].stop()
+            poller = ClusterPoller(cloud_account)
+            self._pollers[account] = poller
+        poller.start()
+        return poller
+
+    def get(self, account):
+        return self._pollers.get(account)
+
+    def snapshot(self, account):
+        # Return the latest snapshot of the account, or None if it is missing or out of date
+        poller = self.get(account)
+        if poller is None or poller.snapshot is None or poller.snapshot["subnets"] is None:
+            return None
+        if time.time() - poller.snapshot["updated"] > 2 * poller.slow_interval:
+            return None
+        return poller.snapshot
+
+    def accounts(self):
+        with self._lock:
+            return list(self._pollers)
+
+    def refresh(self, account):
+        poller = self.get(account)
+        if poller is not None:
+            poller.refresh()
+
+    def poll(self, account):
+        # Poll the account in the calling thread, so that a page rendered right after a change
+        # shows it, and wake its thread to pick the interval for the new cluster states
+        poller = self.get(account)
+        if poller is not None:
+            poller.poll()
+            poller.refresh()
+
+    def sync(self, cloud_accounts):
+        # Poll exactly the accounts of cloud_accounts, a dict of AWS keyed by account name. The
+        # pollers of removed accounts are stopped and accounts whose keys or region changed are
+        # polled from scratch.
+        with self._lock:
+            for account in list(self._pollers):
+                if account not in cloud_accounts:
+                    self._pollers.pop(account).stop()
+
+        for account, cloud_account in cloud_accounts.items():
+            poller = self.get(account)
+            if poller is None or _identity(poller.cloud_account) != _identity(cloud_account):
+                self.add(account, cloud_account)
+
+    def stop_all(self):
+        with self._lock:
+            for poller in self._pollers.values():
+                poller.stop()
+            self._pollers.clear()
+
+    def __contains__(self, account):
+        return account in self._pollers
+
+
+class IdleClusterSweeper(threading.Thread):
+    """Background thread that terminates clusters left idle for longer than `idle_seconds`.
+
+    Every account with a poller in `registry` is swept every `interval` seconds, and only the
+    clusters tagged with `owner(account)` are terminated.
+    """
+
+    def __init__(self, registry, idle_seconds, owner, interval=SWEEP_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.registry = registry
+        self.idle_seconds = idle_seconds
+        self.owner = owner
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            for account in self.registry.accounts():
+                self.sweep(account)
+
+    def sweep(self, account):
+        poller = self.registry.get(account)
+        if poller is None:
+            return []
+
+        try:
+            owner = self.owner(account)
+        except KeyError:
+            # The account was removed since its poller was listed
+            return []
+
+        try:
+            cluster_ids = poller.cloud_account.find_idle_clusters(self.idle_seconds, owner=owner)
+            if cluster_ids:
+                poller.cloud_account.terminate_clusters(cluster_ids)
+                poller.refresh()
+        except AWSException:
+            # Try again on the next sweep
+            return []
+
+        return cluster_ids
+
+    def stop(self):
+        self._stopped.set()
+
+
+pollers = PollerRegistry()
+
+
+# Clusters in these states will not change again
+FINAL_STATES = ["TERMINATED", "TERMINATED_WITH_ERRORS"]
+
+
+class ClusterWatcher(threading.Thread):
+    """Background thread that polls one cluster for as long as anyone is watching it.
+
+    Every watcher of the cluster shares this single poll. `status` only changes, and `version`
+    is only bumped, when the cluster state or its master DNS name changes.
+    """
+
+    def __init__(self, cloud_account, cluster_id, interval=FAST_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.cloud_account = cloud_account
+        self.cluster_id = cluster_id
+        self.interval = interval
+        self.status = None
+        self.version = 0
+        self.subscribers = 0
+        self.finished = False
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            with self._condition:
+                if self.subscribers == 0:
+                    break
+
+            self.poll()
+            if self.status is not None and self.status["state"] in FINAL_STATES:
+                break
+
+            self._stopped.wait(self.interval)
+
+        with self._condition:
+            self.finished = True
+            self._condition.notify_all()
+
+    def poll(self):
+        try:
+            cluster_info = self.cloud_account.describe_cluster(self.cluster_id)["Cluster"]
+        except Exception:
+            # Keep the last known status and try again on the next poll
+            return
+
+        status = dict(state=cluster_info["Status"]["State"],
+                      state_message=cluster_info["Status"].get("StateChangeReason", {})
+                      .get("Message"),
+                      master_public_dns_name=cluster_info.get("MasterPublicDnsName"))
+
+        with self._condition:
+            if self.status is None or \
+                    self.status["state"] != status["state"] or \
+                    self.status["master_public_dns_name"] != status["master_public_dns_name"]:
+                self.status = status
+                self.version += 1
+                self._condition.notify_all()
+
+    def wait(self, version, timeout=None):
+        # Block until the status is newer than version, the watcher finishes or timeout passes
+        with self._condition:
+            if self.version == version and not self.finished:
+                self._condition.wait(timeout)
+            return self.version, self.status
+
+    def add_subscriber(self):
+        with self._condition:
+            self.subscribers += 1
+
+    def remove_subscriber(self):
+        # Stop polling once the last subscriber leaves and return the number left
+        with self._condition:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self.stop()
+            return self.subscribers
+
+    def stop(self):
+        self._stopped.set()
+
+
+class WatcherRegistry:
+    """The cluster watchers that currently have subscribers, keyed by (account, cluster id)."""
+
+    def __init__(self):
+        self._watchers = dict()
+        self._lock = threading.Lock()
+
+    def subscribe(self, account, cluster_id, cloud_account):
+        with self._lock:
+            watcher = self._watchers.get((account, cluster_id))
+            if watcher is None or watcher.finished:
+                watcher = ClusterWatcher(cloud_account, cluster_id)
+                self._watchers[(account, cluster_id)] = watcher
+                watcher.add_subscriber()
+                watcher.start()
+            else:
+                watcher.add_subscriber()
+        return watcher
+
+    def unsubscribe(self, account, cluster_id, watcher):
+        with self._lock:
+            if watcher.remove_subscriber() == 0 and \
+                    self._watchers.get((account, cluster_id)) is watcher:
+                del self._watchers[(account, cluster_id)]
+
+
+watchers = WatcherRegistry()
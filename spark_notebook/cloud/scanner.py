@@ -0,0 +1,73 @@
+from spark_notebook.cloud.aws import ACTIVE_CLUSTER_STATES
+from spark_notebook.cloud.aws import AWS
+from spark_notebook.cloud.cache import cache
+from spark_notebook.cloud.executor import executor
+from spark_notebook.exceptions import AWSException
+
+# Seconds to cache the clusters of an account in a region
+CLUSTERS_TTL = 60
+
+
+def scan(accounts, regions, method, ttl=None, kwargs=None):
+    # Call the AWS method with kwargs for every account in every region concurrently. accounts
+    # maps account names to their credentials. Each account and region is cached on its own for
+    # ttl seconds, so scans of overlapping region sets share their results and a scan costs as
+    # much as its slowest region. Returns one dict per account and region, in order, with either
+    # the result or the error of that call.
+    kwargs = kwargs or dict()
+
+    scans = []
+    for name in sorted(accounts):
+        for region_name in regions:
+            cloud_account = AWS(accounts[name]["access_key_id"],
+                                accounts[name]["secret_access_key"],
+                                region_name)
+            # Keyed like the other answers cached for the account so AWS.invalidate_cache
+            # drops it too. Accounts sharing the same keys share the answer, so it is cached
+            # without the account name.
+            cache_key = (accounts[name]["access_key_id"], region_name, "scan", method,
+                         tuple(sorted(kwargs.items())))
+            answer = cache.get(cache_key) if ttl is not None else None
+            future = None
+            if answer is None:
+                future = executor.submit(getattr(cloud_account, method), **kwargs)
+            scans.append((name, region_name, cache_key, answer, future))
+
+    results = []
+    for name, region_name, cache_key, answer, future in scans:
+        result = dict(account=name, region=region_name, result=answer, error=None)
+        if future is not None:
+            try:
+                result["result"] = future.result()
+                if ttl is not None:
+                    cache.set(cache_key, result["result"], ttl)
+            except AWSException as e:
+                result["error"] = e.msg
+        results.append(result)
+
+    return results
+
+
+def list_account_clusters(accounts, regions, states=ACTIVE_CLUSTER_STATES):
+    # The clusters of every account in every region, as a list of dicts with the account, the
+    # region and either its clusters or an error
+    results = []
+    scans = scan(accounts, regions, "list_clusters", CLUSTERS_TTL, dict(states=tuple(states)))
+    for result in scans:
+        results.append(dict(account=result["account"],
+                            region=result["region"],
+                            clusters=result["result"]["Clusters"] if result["result"] else [],
+                            error=result["error"]))
+    return results
+
+
+def list_account_subnets(accounts, regions, vpc_id=None, tags=None):
+    # The subnets of every account in every region, filtered by VPC and tags. get_subnets caches
+    # them by itself.
+    results = []
+    for result in scan(accounts, regions, "get_subnets", kwargs=dict(vpc_id=vpc_id, tags=tags)):
+        results.append(dict(account=result["account"],
+                            region=result["region"],
+                            subnets=result["result"]["Subnets"] if result["result"] else [],
+                            error=result["error"]))
+    return results
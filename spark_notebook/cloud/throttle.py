@@ -0,0 +1,136 @@
+import random
+import threading
+import time
+
+import botocore.exceptions
+
+# Error codes returned when AWS is rate limiting the requests
+THROTTLING_ERROR_CODES = ["Throttling", "ThrottlingException", "ThrottledException",
+                          "RequestLimitExceeded", "TooManyRequestsException",
+                          "RequestThrottled", "SlowDown"]
+
+# Requests per second allowed for each account and region, and the size of the bursts allowed
+RATE = 20.0
+BURST = 40
+
+# Attempts made for a throttled request and the base of the exponential backoff in seconds
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.5
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate=RATE, capacity=BURST, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Take a token, waiting for one if the bucket is empty. Returns the seconds waited.
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            self.sleep(delay)
+            waited += delay
+
+
+class ThrottleStats:
+    """Counters of the requests made through ThrottledClient."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.throttled = 0
+            self.retries = 0
+            self.wait_time = 0.0
+
+    def add(self, calls=0, throttled=0, retries=0, wait_time=0.0):
+        with self._lock:
+            self.calls += calls
+            self.throttled += throttled
+            self.retries += retries
+            self.wait_time += wait_time
+
+    def as_dict(self):
+        with self._lock:
+            return dict(calls=self.calls, throttled=self.throttled, retries=self.retries,
+                        wait_time=self.wait_time)
+
+
+class ThrottledClient:
+    """Wraps a boto3 client so every API call takes a token from the account's bucket and is
+    retried with jittered exponential backoff while AWS is throttling it.
+
+    The pooled clients are built with botocore's retries turned off, see client_pool, so calls
+    made through paginators and waiters are not retried at all.
+    """
+
+    def __init__(self, client, bucket):
+        self._client = client
+        self._bucket = bucket
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name.startswith("_") or name in ("meta", "exceptions", "get_paginator",
+                                            "get_waiter", "can_paginate") \
+                or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self._call(name, args, kwargs)
+        return call
+
+    def _call(self, name, args, kwargs):
+        for attempt in range(MAX_ATTEMPTS):
+            stats.add(calls=1, wait_time=self._bucket.acquire())
+            try:
+                return getattr(self._client, name)(*args, **kwargs)
+            except botocore.exceptions.ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in THROTTLING_ERROR_CODES:
+                    raise
+                stats.add(throttled=1)
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = random.uniform(0, BASE_DELAY * 2 ** attempt)
+                stats.add(retries=1, wait_time=delay)
+                time.sleep(delay)
+
+
+class BucketRegistry:
+    """One token bucket per (access key id, region)."""
+
+    def __init__(self):
+        self._buckets = dict()
+        self._lock = threading.Lock()
+
+    def get(self, access_key_id, region_name):
+        with self._lock:
+            key = (access_key_id, region_name)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket()
+            return self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+buckets = BucketRegistry()
+stats = ThrottleStats()
@@ -3,6 +3,9 @@ import os
 import os.path
 # noinspection PyPackageRequirements
 import yaml
+from spark_notebook.launch_templates import build_launch_templates
+from spark_notebook.yaml_file import YAMLFile
+from spark_notebook.yaml_file import load_yaml
 
 default_config = {
     "credentials": {
@@ -12,33 +15,67 @@ default_config = {
         "name": "demo-cluster",
         "worker-count": 1,
         "region": "us-east-1",
+        "regions": [],
         "instance-type": "r4.2xlarge",
         "spot-price": 1.0,
-        "open-firewall": True
+        "open-firewall": True,
+        "idle-hours": 0,
+        "max-clusters": 10
     },
     "jupyter": {
         "password": "change-me-321"
-    }
+    },
+    # Named launch templates, see spark_notebook.launch_templates
+    "templates": {}
 }
 
 
-class Config:
+class Config(YAMLFile):
+    """The settings in config.yaml merged over default_config.
+
+    `config` is a snapshot that is never modified once it is published, see YAMLFile.
+    """
 
     def __init__(self, file_path="./config.yaml"):
-        self.config = dict()
-        self.file_path = file_path
-        self.load()
-
-    def load(self):
-        self.config = copy.deepcopy(default_config)
-
-        if os.path.isfile(self.file_path):
-            with open(self.file_path, 'r') as stream:
-                file_yaml = yaml.load(stream)
-                self.config["credentials"].update(file_yaml["credentials"])
-                self.config["emr"].update(file_yaml["emr"])
-                self.config["jupyter"].update(file_yaml["jupyter"])
-
-    def save(self):
-        with open(self.file_path, 'w') as stream:
-            stream.write(yaml.safe_dump(self.config, default_flow_style=False))
+        self._launch_templates = None
+        YAMLFile.__init__(self, file_path)
+
+    @property
+    def config(self):
+        return self._data()
+
+    @property
+    def launch_templates(self):
+        # The run_job_flow payloads of the launch templates, validated and built once for every
+        # snapshot of the config. Raises ConfigException if a template is invalid.
+        config = self.config
+        launch_templates = self._launch_templates
+        if launch_templates is None or launch_templates[0] is not config:
+            launch_templates = (config, build_launch_templates(config))
+            self._launch_templates = launch_templates
+        return launch_templates[1]
+
+    def set(self, section, key, value):
+        # Change one setting and save the config file
+        with self._lock:
+            self._reload(self.file_path)
+            config = copy.deepcopy(self._snapshot[1])
+            config[section][key] = value
+            self._swap(self.file_path, config)
+
+    def _read(self, file_path):
+        config = copy.deepcopy(default_config)
+
+        if os.path.isfile(file_path):
+            with open(file_path, 'r') as stream:
+                file_yaml = load_yaml(stream)
+                config["credentials"].update(file_yaml["credentials"])
+                config["emr"].update(file_yaml["emr"])
+                config["jupyter"].update(file_yaml["jupyter"])
+                config["templates"].update(file_yaml.get("templates") or dict())
+
+        return config
+
+    def _write(self, file_path, config):
+        with open(file_path, 'w') as stream:
+            stream.write(yaml.safe_dump(config, default_flow_style=False))
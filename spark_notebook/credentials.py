@@ -1,40 +1,285 @@
+import contextlib
 import os
+import sqlite3
+import stat
+import time
 # noinspection PyPackageRequirements
 import yaml
 from spark_notebook.exceptions import CredentialsException
+from spark_notebook.yaml_file import YAMLFile
+from spark_notebook.yaml_file import load_yaml
 
+# Credentials files with these extensions are SQLite databases instead of YAML files
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
 
-class Credentials:
+# The settings of every account besides its name
+FIELDS = ("email_address", "access_key_id", "secret_access_key", "key_name", "ssh_key")
+
+# Seconds a write waits for another process holding the SQLite database
+SQLITE_TIMEOUT = 10
+
+# Mode of new credentials files, which hold secret access keys
+FILE_MODE = 0o600
+
+# os.replace is atomic on every platform but is missing on Python 2
+_replace = getattr(os, "replace", os.rename)
+
+
+def _check_base_directory(file_path):
+    # A bare file name is in the current directory
+    base_directory = os.path.dirname(file_path) or os.curdir
+    if not os.path.exists(base_directory):
+        raise CredentialsException("Base directory %s does not exist." % base_directory)
+
+
+def _file_mode(file_path):
+    # The permissions of the file, or FILE_MODE if it does not exist yet
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except OSError:
+        return FILE_MODE
+
+
+def _is_sqlite(file_path):
+    return os.path.splitext(file_path)[1].lower() in SQLITE_EXTENSIONS
+
+
+def _account(email_address, access_key_id, secret_access_key, key_name, ssh_key):
+    return dict(email_address=email_address,
+                access_key_id=access_key_id,
+                secret_access_key=secret_access_key,
+                key_name=key_name,
+                ssh_key=ssh_key)
+
+
+class YAMLCredentials(YAMLFile):
+    """The AWS accounts in a YAML credentials file, keyed by account name.
+
+    `credentials` is a snapshot that is never modified once it is published, see YAMLFile.
+    Every change writes the whole file to a temporary file that then replaces it. The new
+    snapshot is only swapped in after that, so a failed write changes nothing, and accounts
+    added at the same time are all kept.
+    """
+
+    @property
+    def credentials(self):
+        return self._data()
+
+    def get(self, name):
+        return self.credentials[name]
+
+    def find(self, email_address=None, key_name=None):
+        # The names of the accounts with the given email address and key name
+        names = []
+        for name, account in self.credentials.items():
+            if email_address is not None and account.get("email_address") != email_address:
+                continue
+            if key_name is not None and account.get("key_name") != key_name:
+                continue
+            names.append(name)
+        return sorted(names)
+
+    def use(self, file_path):
+        # Switch to the credentials file at file_path, creating it if it does not exist yet
+        with self._lock:
+            self._swap(file_path, self._read(file_path))
+
+    def add(self, name, email_address, access_key_id, secret_access_key, key_name, ssh_key):
+        with self._lock:
+            self._reload(self.file_path)
+            credentials = dict(self._snapshot[1])
+            credentials[name] = _account(email_address, access_key_id, secret_access_key,
+                                         key_name, ssh_key)
+            self._swap(self.file_path, credentials)
+
+    def _read(self, file_path):
+        if os.path.isfile(file_path):
+            with open(file_path, 'r') as stream:
+                return load_yaml(stream) or dict()
+        return dict()
+
+    def _write(self, file_path, credentials):
+        # The temporary file gets the permissions of the file it replaces before anything is
+        # written to it, and reaches the disk before it replaces the file
+        _check_base_directory(file_path)
+        mode = _file_mode(file_path)
+        temp_path = file_path + ".tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, 'w') as stream:
+            os.chmod(temp_path, mode)
+            stream.write(yaml.safe_dump(credentials, default_flow_style=False))
+            stream.flush()
+            os.fsync(stream.fileno())
+        _replace(temp_path, file_path)
+
+
+class SQLiteCredentials:
+    """The AWS accounts in a SQLite credentials database, one row per account.
+
+    Adding or replacing an account is a single transaction that leaves the other accounts
+    alone, so writes are atomic and cost the same however many accounts there are. Accounts
+    are looked up through the indexes on the name, the email address and the key name, without
+    loading the others. Every call opens its own connection, so it can be used from any thread.
+    """
 
     def __init__(self, file_path):
-        self.credentials = dict()
         self.file_path = file_path
-        self.load()
 
-    def load(self):
-        if os.path.isfile(self.file_path):
-            with open(self.file_path, 'r') as stream:
-                self.credentials = yaml.load(stream)
+    @property
+    def credentials(self):
+        return dict(self._select("SELECT * FROM accounts ORDER BY name"))
 
-    def add(self, name, email_address, access_key_id, secret_access_key, key_name, ssh_key):
-        new_credentials = dict()
-        new_credentials[name] = dict(email_address=email_address,
-                                     access_key_id=access_key_id,
-                                     secret_access_key=secret_access_key,
-                                     key_name=key_name,
-                                     ssh_key=ssh_key)
+    def get(self, name):
+        accounts = self._select("SELECT * FROM accounts WHERE name = ?", (name,))
+        if not accounts:
+            raise KeyError(name)
+        return accounts[0][1]
+
+    def find(self, email_address=None, key_name=None):
+        # The names of the accounts with the given email address and key name
+        conditions = []
+        args = []
+        if email_address is not None:
+            conditions.append("email_address = ?")
+            args.append(email_address)
+        if key_name is not None:
+            conditions.append("key_name = ?")
+            args.append(key_name)
 
-        temp_credentials = dict(self.credentials).copy()
-        temp_credentials.update(new_credentials)
+        query = "SELECT * FROM accounts"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return [name for name, _ in self._select(query + " ORDER BY name", args)]
 
-        self.credentials = temp_credentials
-        self.save()
+    def load(self, file_path=None):
+        # Every read goes to the database, so there is nothing to load besides switching to a
+        # different database if file_path is given
+        if file_path is not None:
+            self.file_path = file_path
+
+    def use(self, file_path):
+        # Switch to the database at file_path, creating it if it does not exist yet
+        with contextlib.closing(self._create(file_path)):
+            pass
+        self.file_path = file_path
+
+    def add(self, name, email_address, access_key_id, secret_access_key, key_name, ssh_key):
+        self.add_all({name: _account(email_address, access_key_id, secret_access_key, key_name,
+                                     ssh_key)})
+
+    def add_all(self, accounts):
+        # Add or replace every account of the dict in a single transaction
+        with contextlib.closing(self._create(self.file_path)) as connection:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO accounts (name, %s) VALUES (?, %s)" %
+                    (", ".join(FIELDS), ", ".join("?" * len(FIELDS))),
+                    [[name] + [accounts[name].get(field) for field in FIELDS]
+                     for name in sorted(accounts)])
 
     def save(self):
-        # Check if the base directory exists
-        if os.path.exists(os.path.dirname(self.file_path)):
-            with open(self.file_path, 'w') as stream:
-                stream.write(yaml.safe_dump(self.credentials, default_flow_style=False))
+        # Every change is saved as it is made, so only make sure the database exists
+        self.use(self.file_path)
+
+    def _connect(self, file_path):
+        return sqlite3.connect(file_path, timeout=SQLITE_TIMEOUT)
+
+    def _create(self, file_path):
+        # Connect to the database at file_path, creating it and its table first if needed. Only
+        # writes call this, so reading does not need write access to the database.
+        _check_base_directory(file_path)
+        if not os.path.exists(file_path):
+            # Create the database readable by its owner only. SQLite gives its journal files the
+            # same permissions.
+            os.close(os.open(file_path, os.O_WRONLY | os.O_CREAT, FILE_MODE))
+        connection = self._connect(file_path)
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, %s)" %
+                               ", ".join("%s TEXT" % field for field in FIELDS))
+            connection.execute("CREATE INDEX IF NOT EXISTS accounts_email_address "
+                               "ON accounts (email_address)")
+            connection.execute("CREATE INDEX IF NOT EXISTS accounts_key_name "
+                               "ON accounts (key_name)")
+        return connection
+
+    def _select(self, query, args=()):
+        # Return (name, account) pairs, leaving out the settings the account does not have
+        if not os.path.isfile(self.file_path):
+            return []
+
+        with contextlib.closing(self._connect(self.file_path)) as connection:
+            try:
+                cursor = connection.execute(query, args)
+            except sqlite3.OperationalError as e:
+                # No account has been added to the database yet
+                if str(e).startswith("no such table"):
+                    return []
+                raise
+            columns = [column[0] for column in cursor.description]
+            accounts = []
+            for row in cursor.fetchall():
+                account = dict((column, value) for column, value in zip(columns, row)
+                               if value is not None)
+                accounts.append((account.pop("name"), account))
+            return accounts
+
+
+def _open(file_path, clock=time.time):
+    if _is_sqlite(file_path):
+        return SQLiteCredentials(file_path)
+    return YAMLCredentials(file_path, clock=clock)
+
+
+class Credentials:
+    """The AWS accounts, keyed by account name.
+
+    They are kept in a YAML file, or in a SQLite database when the file name ends with one of
+    SQLITE_EXTENSIONS. Loading or using a file of the other kind switches the store.
+    """
+
+    def __init__(self, file_path, clock=time.time):
+        self.clock = clock
+        self._store = _open(file_path, clock)
+
+    @property
+    def file_path(self):
+        return self._store.file_path
+
+    @property
+    def credentials(self):
+        return self._store.credentials
+
+    def get(self, name):
+        return self._store.get(name)
+
+    def find(self, email_address=None, key_name=None):
+        return self._store.find(email_address, key_name)
+
+    def load(self, file_path=None):
+        if file_path is not None and _is_sqlite(file_path) != _is_sqlite(self.file_path):
+            self._store = _open(file_path, self.clock)
+        else:
+            self._store.load(file_path)
+
+    def use(self, file_path):
+        if _is_sqlite(file_path) != _is_sqlite(self.file_path):
+            store = _open(file_path, self.clock)
+            store.use(file_path)
+            self._store = store
         else:
-            raise CredentialsException("Base directory %s does not exist." %
-                                       os.path.dirname(self.file_path))
+            self._store.use(file_path)
+
+    def add(self, name, email_address, access_key_id, secret_access_key, key_name, ssh_key):
+        self._store.add(name, email_address, access_key_id, secret_access_key, key_name,
+                        ssh_key)
+
+    def save(self):
+        self._store.save()
+
+
+def migrate(yaml_path, sqlite_path):
+    # Copy every account of a YAML credentials file into a SQLite credentials database and
+    # return their number
+    accounts = YAMLCredentials(yaml_path).credentials
+    SQLiteCredentials(sqlite_path).add_all(accounts)
+    return len(accounts)
@@ -17,3 +17,12 @@ class CredentialsException(Exception):
 
     def __str__(self):
         return self.msg
+
+
+class ConfigException(Exception):
+
+    def __init__(self, arg):
+        self.msg = arg
+
+    def __str__(self):
+        return self.msg
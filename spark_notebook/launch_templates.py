@@ -0,0 +1,131 @@
+from spark_notebook.cloud.aws import MAX_FLEET_INSTANCE_TYPES
+from spark_notebook.cloud.aws import MAX_SPOT_TIMEOUT
+from spark_notebook.cloud.aws import MIN_SPOT_TIMEOUT
+from spark_notebook.cloud.aws import SPOT_TIMEOUT
+from spark_notebook.cloud.aws import build_launch_template
+from spark_notebook.exceptions import ConfigException
+
+# The settings of a launch template in the templates section of config.yaml. Missing settings
+# are taken from the emr and jupyter sections.
+SETTINGS = ("instance-type", "instance-types", "worker-count", "spot", "spot-price",
+            "spot-timeout", "bootstrap-path", "python-version", "password")
+
+PYTHON_VERSIONS = ("2", "3")
+
+
+def build_launch_templates(config):
+    # Validate the templates section of config and build the run_job_flow payload of every
+    # launch template, keyed by template name. Raises ConfigException for the first invalid one.
+    launch_templates = dict()
+    for name, settings in sorted((config.get("templates") or dict()).items()):
+        launch_templates[name] = _build(name, settings or dict(), config)
+    return launch_templates
+
+
+def parse_instance_types(value, instance_type=None):
+    # Parse the other instance types of an instance fleet into (instance type, weighted
+    # capacity) pairs. value is either a string like "r4.4xlarge:2, r5.2xlarge", a mapping of
+    # instance types to weights or a list of instance types, whose weight defaults to 1.
+    # instance_type, the main type of the cluster, is left out if it is listed again.
+    if not value:
+        return []
+
+    if isinstance(value, dict):
+        items = list(value.items())
+    elif isinstance(value, list):
+        items = [(item, 1) for item in value]
+    else:
+        items = []
+        for item in str(value).split(","):
+            if item.strip() != "":
+                fleet_type, _, weight = item.strip().partition(":")
+                items.append((fleet_type.strip(), weight.strip() or 1))
+
+    instance_types = []
+    for fleet_type, weight in items:
+        try:
+            weight = int(weight)
+        except (TypeError, ValueError):
+            weight = 0
+        if not fleet_type or weight < 1:
+            raise ConfigException("Invalid instance type for the instance fleet: %s" % fleet_type)
+        if fleet_type != instance_type and fleet_type not in dict(instance_types):
+            instance_types.append((str(fleet_type), weight))
+
+    if len(instance_types) >= MAX_FLEET_INSTANCE_TYPES:
+        raise ConfigException("An instance fleet can have at most %d other instance types" %
+                              (MAX_FLEET_INSTANCE_TYPES - 1))
+    return instance_types
+
+
+def parse_spot_timeout(value):
+    # Parse the minutes an instance fleet waits for spot capacity
+    if value is None or value == "":
+        return SPOT_TIMEOUT
+    try:
+        spot_timeout = int(value)
+    except (TypeError, ValueError):
+        spot_timeout = 0
+    if not MIN_SPOT_TIMEOUT <= spot_timeout <= MAX_SPOT_TIMEOUT:
+        raise ConfigException("The spot timeout must be between %d and %d minutes" %
+                              (MIN_SPOT_TIMEOUT, MAX_SPOT_TIMEOUT))
+    return spot_timeout
+
+
+def parse_spot_price(value):
+    # Parse the price bid for a spot instance, or for one unit of capacity of an instance fleet
+    try:
+        spot_price = float(value)
+    except (TypeError, ValueError):
+        spot_price = 0
+    if not spot_price > 0:
+        raise ConfigException("The spot price must be a positive number")
+    return spot_price
+
+
+def _build(name, settings, config):
+    if not isinstance(settings, dict):
+        raise ConfigException("Launch template %s must be a mapping of settings" % name)
+
+    unknown = sorted(set(settings) - set(SETTINGS))
+    if unknown:
+        raise ConfigException("Launch template %s has unknown settings: %s" %
+                              (name, ", ".join(unknown)))
+
+    instance_type = settings.get("instance-type", config["emr"]["instance-type"])
+    if not instance_type:
+        raise ConfigException("Launch template %s has no instance-type" % name)
+
+    try:
+        worker_count = int(settings.get("worker-count", config["emr"]["worker-count"]))
+    except (TypeError, ValueError):
+        worker_count = 0
+    if worker_count < 1:
+        raise ConfigException("Launch template %s needs a worker-count of at least 1" % name)
+
+    spot = settings.get("spot", False)
+    if not isinstance(spot, bool):
+        raise ConfigException("Launch template %s must set spot to true or false" % name)
+
+    bootstrap_path = settings.get("bootstrap-path")
+    if bootstrap_path is not None and not str(bootstrap_path).startswith("s3://"):
+        raise ConfigException("Launch template %s needs an s3:// bootstrap-path" % name)
+
+    python_version = str(settings.get("python-version", "3"))
+    if python_version not in PYTHON_VERSIONS:
+        raise ConfigException("Launch template %s needs a python-version of %s" %
+                              (name, " or ".join(PYTHON_VERSIONS)))
+
+    try:
+        spot_price = None
+        if spot:
+            spot_price = parse_spot_price(settings.get("spot-price", config["emr"]["spot-price"]))
+        instance_types = parse_instance_types(settings.get("instance-types"), instance_type)
+        spot_timeout = parse_spot_timeout(settings.get("spot-timeout"))
+    except ConfigException as e:
+        raise ConfigException("Launch template %s: %s" % (name, e.msg))
+
+    password = settings.get("password", config["jupyter"]["password"])
+
+    return build_launch_template(instance_type, worker_count, spot, spot_price, bootstrap_path,
+                                 python_version, password, instance_types, spot_timeout)
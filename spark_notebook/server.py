@@ -1,20 +1,39 @@
+import json
 import os
 import os.path
 import distutils.util
+import threading
+import time
 
+from .cloud.aws import ACTIVE_CLUSTER_STATES
 from .cloud.aws import AWS
+from .cloud.aws import SPOT_TIMEOUT
+from .cloud.aws import build_launch_template
+from .cloud.executor import executor
+from .cloud.poller import IdleClusterSweeper
+from .cloud.poller import pollers
+from .cloud.poller import watchers
+from .cloud.scanner import list_account_clusters
+from .cloud.scanner import list_account_subnets
+from .cloud.throttle import stats
 from .config import Config
 from .credentials import Credentials
+from .launch_templates import parse_instance_types
+from .launch_templates import parse_spot_price
+from .launch_templates import parse_spot_timeout
 
 from flask import Flask
+from flask import Response
 from flask import redirect
 from flask import request
 from flask import render_template
 from flask import url_for
 from flask import flash
+from flask import jsonify
 
 import botocore.exceptions
 from spark_notebook.exceptions import AWSException
+from spark_notebook.exceptions import ConfigException
 from spark_notebook.exceptions import CredentialsException
 
 app = Flask(__name__)
@@ -22,16 +41,86 @@ app.secret_key = 'some_secret'
 config = Config()
 credentials = Credentials(config.config["credentials"]["path"])
 
+# Held while config and credentials are switched to other files, so that they are always
+# switched together. Readers never take it.
+_state_lock = threading.Lock()
+
+# Seconds an event stream stays open before it ends and the browser reconnects, and the
+# milliseconds the browser waits before reconnecting. Every open stream holds a server thread,
+# so ending them lets other requests queued behind them run.
+EVENT_STREAM_SECONDS = 30
+EVENT_STREAM_RETRY = 1000
+
+
+def load_config(file_path=None):
+    # Load the config file, or reload the current one, and the credentials file it points to
+    with _state_lock:
+        config.load(file_path)
+        credentials.load(config.config["credentials"]["path"])
+    if pollers.enabled:
+        _sync_pollers()
+    return config
+
+
+def _regions():
+    # The regions scanned by the views that span regions
+    return config.config["emr"]["regions"] or [config.config["emr"]["region"]]
+
+
+def _region():
+    # The region of the request, given as ?region= or a region form field
+    return request.values.get("region") or config.config["emr"]["region"]
+
+
+def _region_arg():
+    # The region to carry in the links of a page, None for the configured region
+    if _region() != config.config["emr"]["region"]:
+        return _region()
+    return None
+
+
+def _cloud_account(account):
+    account_credentials = credentials.get(account)
+    return AWS(account_credentials["access_key_id"],
+               account_credentials["secret_access_key"],
+               _region())
+
+
+def _sync_pollers():
+    # Poll the accounts of the current credentials file with their current keys
+    pollers.sync(dict((account, AWS(account_credentials["access_key_id"],
+                                    account_credentials["secret_access_key"],
+                                    config.config["emr"]["region"]))
+                      for account, account_credentials in credentials.credentials.items()))
+
+
+def start_pollers():
+    # Keep a background snapshot of the clusters of every configured account
+    pollers.enabled = True
+    _sync_pollers()
+
+    # Terminate the clusters each account left idle if emr:idle-hours in config.yml is set
+    if float(config.config["emr"]["idle-hours"]) > 0:
+        IdleClusterSweeper(pollers, float(config.config["emr"]["idle-hours"]) * 3600,
+                           _account_owner).start()
+
+
+def _account_owner(account):
+    # The email address the clusters launched by the account are tagged with
+    return credentials.get(account)["email_address"]
+
 
 @app.route('/', methods=['GET'])
 def main():
 
     if "config_path" in request.args:
-        global config
-        global credentials
-        config = Config(file_path=request.args.get('config_path'))
-        credentials = Credentials(config.config["credentials"]["path"])
-        flash("Using config file: %s" % config.file_path)
+        flash("Using config file: %s" % load_config(request.args.get('config_path')).file_path)
+
+        # Build the launch templates now so a mistake in them shows up right away
+        try:
+            config.launch_templates
+        except ConfigException as e:
+            flash("Error: %s" % e.msg)
 
     if os.path.isfile(config.config["credentials"]["path"]):
         return redirect(url_for('accounts'))
@@ -98,6 +187,10 @@ def accounts():
                 error = e.msg
 
         if error is None:
+            # The account may replace one that used the same keys
+            cloud_account.invalidate_cache()
+            if pollers.enabled:
+                pollers.add(name, cloud_account)
             flash("Account %s added" % name)
 
     return render_template('accounts.html',
@@ -106,6 +199,38 @@ def accounts():
                            error=error)
 
 
+@app.route('/dashboard', methods=['GET'])
+def dashboard():
+    # The active clusters of every account, in the configured regions or the requested ones
+    regions = request.args.getlist("region") or _regions()
+
+    results = list_account_clusters(credentials.credentials, regions)
+
+    clusters = []
+    errors = []
+    for result in results:
+        if result["error"] is not None:
+            errors.append("%s (%s): %s" % (result["account"], result["region"], result["error"]))
+
+        # Links only carry the region when it is not the configured one
+        region_arg = result["region"]
+        if region_arg == config.config["emr"]["region"]:
+            region_arg = None
+
+        for cluster in result["clusters"]:
+            clusters.append(dict(account=result["account"],
+                                 region=result["region"],
+                                 region_arg=region_arg,
+                                 id=cluster["Id"],
+                                 name=cluster["Name"],
+                                 state=cluster["Status"]["State"]))
+
+    return render_template('dashboard.html',
+                           clusters=clusters,
+                           regions=regions,
+                           error="; ".join(errors) or None)
+
+
 @app.route('/config', methods=['GET', 'POST'])
 def save_config_location():
     error = None
@@ -113,18 +238,18 @@ def save_config_location():
     if request.method == 'POST':
         path = request.form['path'].encode('utf8').decode()
 
-        global credentials
-        credentials = Credentials(path)
-        try:
-            credentials.save()
-        except CredentialsException as e:
-            error = e.msg
+        with _state_lock:
+            try:
+                credentials.use(path)
+            except CredentialsException as e:
+                error = e.msg
+
+            # If there were no errors saving the credentials file then update the credentials
+            # path in the config file
+            if error is None:
+                config.set("credentials", "path", path)
 
-        # If there were no errors saving the credentials file then update the credentials path in
-        # the config file
         if error is None:
-            config.config["credentials"]["path"] = path
-            config.save()
             flash("Credentials saved to %s" % path)
             return redirect(url_for('accounts'))
 
@@ -139,9 +264,7 @@ def cluster_list_create(account):
     subnets = None
     cluster_list = None
 
-    cloud_account = AWS(credentials.credentials[account]["access_key_id"],
-                        credentials.credentials[account]["secret_access_key"],
-                        config.config["emr"]["region"])
+    cloud_account = _cloud_account(account)
 
     # if request method is post then create the cluster
     if request.method == "POST":
@@ -154,6 +277,9 @@ def cluster_list_create(account):
         spot_price = None
         bootstrap_path = None
         pyspark_python_version = None
+        count = 1
+        instance_types = None
+        spot_timeout = None
 
         if "name" in request.form:
             if request.form["name"].encode('utf8').decode() != "":
@@ -195,51 +321,174 @@ def cluster_list_create(account):
             if request.form["pyspark_python_version"].encode('utf8').decode() != "":
                 pyspark_python_version = request.form["pyspark_python_version"].encode('utf8')\
                     .decode()
+        if "count" in request.form:
+            if request.form["count"].encode('utf8').decode() != "":
+                # Every cluster is a run_job_flow call, so a single request is capped at
+                # emr:max-clusters in config.yml
+                max_clusters = int(config.config['emr']['max-clusters'])
+                try:
+                    count = int(request.form["count"].encode('utf8').decode())
+                except ValueError:
+                    count = 0
+                if not 1 <= count <= max_clusters:
+                    error = "The number of clusters must be between 1 and %d" % max_clusters
+        if "instance_types" in request.form:
+            instance_types = request.form["instance_types"].encode('utf8').decode()
+        if "spot_timeout" in request.form:
+            spot_timeout = request.form["spot_timeout"].encode('utf8').decode()
+
+        tags = [{"Key": "cluster", "Value": credentials.get(account)["email_address"]}]
+        key_name = credentials.get(account)["key_name"]
+
+        # A launch template from config.yml replaces the settings of the form besides the name,
+        # the subnet and the number of clusters
+        launch_template = None
+        if error is None and request.form.get("template", "") != "":
+            template = request.form["template"].encode('utf8').decode()
+            try:
+                launch_template = config.launch_templates[template]
+            except KeyError:
+                error = "Unknown launch template: %s" % template
+            except ConfigException as e:
+                error = e.msg
+        elif error is None:
+            # Other instance types launch the cluster with instance fleets
+            try:
+                if use_spot:
+                    spot_price = parse_spot_price(spot_price)
+                launch_template = build_launch_template(
+                    instance_type, worker_count, use_spot, spot_price, bootstrap_path,
+                    pyspark_python_version, password,
+                    parse_instance_types(instance_types, instance_type),
+                    parse_spot_timeout(spot_timeout))
+            except ConfigException as e:
+                error = e.msg
 
-        tags = [{"Key": "cluster", "Value": credentials.credentials[account]["email_address"]}]
+        if error is None and count > 1:
+            try:
+                cluster_ids, errors = cloud_account.launch_clusters(
+                    launch_template, count, name, key_name, subnet_id, tags)
+            except AWSException as e:
+                cluster_ids, errors = [], [e.msg]
+
+            if cluster_ids:
+                pollers.poll(account)
+                flash("Clusters launched: %d of %d" % (len(cluster_ids), count))
+            if errors:
+                error = "; ".join(errors)
+            else:
+                return redirect(url_for('cluster_list_create', account=account,
+                                        region=_region_arg()))
 
+        elif error is None:
+            try:
+                cluster_id = cloud_account.launch_cluster(launch_template, name, key_name,
+                                                          subnet_id, tags)
+                pollers.poll(account)
+                flash("Cluster launched: %s" % name)
+                return redirect(url_for('cluster_details', account=account,
+                                        cluster_id=cluster_id, region=_region_arg()))
+            except AWSException as e:
+                error = e.msg
+
+    # The pollers only follow the configured region
+    snapshot = None
+    if _region_arg() is None:
+        snapshot = pollers.snapshot(account)
+    if snapshot is not None:
+        # Read the cluster list and the subnets from the background poller
+        cluster_list = snapshot["clusters"]
+        subnets = snapshot["subnets"]
+        if snapshot["error"] is not None:
+            error = snapshot["error"]
+    else:
+        # Populate the cluster list with the active clusters. Terminated clusters are loaded by
+        # the page on demand from cluster_list_json
         try:
-            cluster_id = cloud_account.create_cluster(name,
-                                                      credentials.credentials[account]["key_name"],
-                                                      instance_type, worker_count, subnet_id,
-                                                      use_spot, spot_price, bootstrap_path,
-                                                      pyspark_python_version, tags,
-                                                      password)
-            flash("Cluster launched: %s" % name)
-            return redirect(url_for('cluster_details', account=account,
-                                    cluster_id=cluster_id))
+            cluster_list = cloud_account.list_clusters(states=ACTIVE_CLUSTER_STATES)
         except AWSException as e:
             error = e.msg
 
-    # Populate the cluster list
-    try:
-        cluster_list = cloud_account.list_clusters()
-    except AWSException as e:
-        error = e.msg
-
-    # Populate the subnets dropdownlist
-    try:
-        subnets = cloud_account.get_subnets()
-    except AWSException as e:
-        error = e.msg
+        # Populate the subnets dropdownlist if they are cached, otherwise the page fetches them
+        # from subnets_json once it has rendered
+        if cloud_account.get_cached_subnets() is not None:
+            subnets = cloud_account.get_subnets()
 
     data = {
         'account': account,
+        'region': _region_arg(),
+        'region_name': _region(),
+        'region_query': "?region=%s" % _region_arg() if _region_arg() else "",
         'account_name': account,
         'cluster_name': config.config['emr']['name'],
         'worker_count': str(config.config['emr']['worker-count']),
         'spot_price': "%.2f" % config.config['emr']['spot-price'],
         'instance_type': config.config['emr']['instance-type'],
         'password': config.config['jupyter']['password'],
-        'subnets': sorted(subnets["Subnets"], key=lambda k: k["AvailabilityZone"]),
+        'idle_hours': str(config.config['emr']['idle-hours']),
+        'max_clusters': str(config.config['emr']['max-clusters']),
+        'spot_timeout': str(SPOT_TIMEOUT),
+        'subnets': subnets["Subnets"] if subnets is not None else None,
+        'templates': [],
     }
 
+    try:
+        data['templates'] = sorted(config.launch_templates)
+    except ConfigException as e:
+        error = error or e.msg
+
     return render_template('emr-list-create.html',
                            cluster_list=cluster_list,
                            data=data,
                            error=error)
 
 
+@app.route('/g/<account>/clusters', methods=['GET'])
+def cluster_list_json(account):
+    cloud_account = _cloud_account(account)
+
+    states = request.args.getlist("state") or None
+    marker = request.args.get("marker") or None
+
+    try:
+        clusters, marker = cloud_account.list_clusters_page(states=states, marker=marker)
+    except AWSException as e:
+        return jsonify(error=e.msg), 500
+
+    return jsonify(clusters=[{"id": cluster["Id"],
+                              "name": cluster["Name"],
+                              "state": cluster["Status"]["State"]} for cluster in clusters],
+                   marker=marker)
+
+
+@app.route('/g/<account>/subnets', methods=['GET'])
+def subnets_json(account):
+    # The subnets of the account in the region of the request, or in every region given with
+    # region= when there is more than one
+    regions = request.args.getlist("region") or [_region()]
+
+    # Tags are given as tag=Key=Value
+    tags = dict()
+    for tag in request.args.getlist("tag"):
+        key, _, value = tag.partition("=")
+        tags[key] = value
+
+    results = list_account_subnets({account: credentials.get(account)}, regions,
+                                   vpc_id=request.args.get("vpc_id") or None, tags=tags)
+
+    subnets = []
+    for result in results:
+        if result["error"] is not None:
+            return jsonify(error=result["error"]), 500
+        for subnet in result["subnets"]:
+            subnets.append({"id": subnet["SubnetId"],
+                            "availability_zone": subnet["AvailabilityZone"],
+                            "vpc_id": subnet.get("VpcId"),
+                            "region": result["region"]})
+
+    return jsonify(subnets=subnets)
+
+
 @app.route('/g/<account>/<cluster_id>', methods=["GET", "POST"])
 def cluster_details(account, cluster_id):
     error = None
@@ -251,12 +500,15 @@ def cluster_details(account, cluster_id):
     ssh_key = None
     logs_bucket_name = None
 
-    cloud_account = AWS(credentials.credentials[account]["access_key_id"],
-                        credentials.credentials[account]["secret_access_key"],
-                        config.config["emr"]["region"])
+    cloud_account = _cloud_account(account)
+
+    # The cluster description and the logs bucket check do not depend on each other, so both are
+    # dispatched at once. Calls that need the cluster state are chained once it is known.
+    describe_future = executor.submit(cloud_account.describe_cluster, cluster_id)
+    logs_bucket_future = executor.submit(_check_logs_bucket, cloud_account)
 
     try:
-        cluster_info = cloud_account.describe_cluster(cluster_id)["Cluster"]
+        cluster_info = describe_future.result()["Cluster"]
         if "Status" in cluster_info:
             if "State" in cluster_info['Status']:
                 state = cluster_info['Status']['State']
@@ -266,18 +518,34 @@ def cluster_details(account, cluster_id):
     except AWSException as e:
         error = e.msg
 
-    # Check if the EMR logs bucket exists and is accessible to the user
-    try:
-        logs_bucket_name = "aws-logs-%s-%s" % (cloud_account.get_account_id(),
-                                               cloud_account.region_name)
-        cloud_account.head_s3_bucket(logs_bucket_name)
-    except AWSException as e:
-        error = e.msg
-
     # Only get the bootstrap information from running or waiting clusters
+    bootstrap_future = None
     if state == "RUNNING" or state == "WAITING":
+        bootstrap_future = executor.submit(cloud_account.list_bootstrap_actions, cluster_id)
+
+    ports_future = None
+    if "Ec2InstanceAttributes" in cluster_info:
+        if "EmrManagedMasterSecurityGroup" in cluster_info["Ec2InstanceAttributes"]:
+            master_security_group = cluster_info["Ec2InstanceAttributes"][
+                "EmrManagedMasterSecurityGroup"]
+            # Check and open SSH port
+            ports = [(22, "SSH")]
+            # If emr:open-firewall in config.yml is True then open the extra ports in the firewall
+            if bool(distutils.util.strtobool(str(config.config['emr']['open-firewall']))):
+                ports += [(8088, "YARN ResourceManager"),
+                          (8888, "Jupyter Notebook"),
+                          (18080, "Spark HistoryServer")]
+            ports_future = executor.submit(cloud_account.open_security_group_ports,
+                                           master_security_group, ports)
+
+    # Check if the EMR logs bucket exists and is accessible to the user
+    logs_bucket_name, logs_bucket_error = logs_bucket_future.result()
+    if logs_bucket_error is not None:
+        error = logs_bucket_error
+
+    if bootstrap_future is not None:
         try:
-            bootstrap_actions = cloud_account.list_bootstrap_actions(cluster_id)["BootstrapActions"]
+            bootstrap_actions = bootstrap_future.result()["BootstrapActions"]
         except AWSException as e:
             error = e.msg
 
@@ -286,40 +554,28 @@ def cluster_details(account, cluster_id):
                 if action["Name"] == "jupyter-provision":
                     password = action["Args"][0]
 
+    if ports_future is not None:
+        try:
+            ports_future.result()
+        except AWSException as e:
+            error = e.msg
+
     master_public_dns_name = None
 
     if "MasterPublicDnsName" in cluster_info:
         master_public_dns_name = cluster_info["MasterPublicDnsName"]
 
-    if "Ec2InstanceAttributes" in cluster_info:
-        if "EmrManagedMasterSecurityGroup" in cluster_info["Ec2InstanceAttributes"]:
-            master_security_group = cluster_info["Ec2InstanceAttributes"][
-                "EmrManagedMasterSecurityGroup"]
-            # Check and open SSH port
-            if not cloud_account.get_security_group_port_open(master_security_group, 22):
-                cloud_account.authorize_security_group_ingress(master_security_group, 22, "SSH")
-            # If emr:open-firewall in config.yml is True then open the extra ports in the firewall
-            if bool(distutils.util.strtobool(str(config.config['emr']['open-firewall']))):
-                # Check and open YARN ResourceManager port
-                if not cloud_account.get_security_group_port_open(master_security_group, 8088):
-                    cloud_account.authorize_security_group_ingress(master_security_group, 8088,
-                                                                   "YARN ResourceManager")
-                # Check and open Jupyter Notebook port
-                if not cloud_account.get_security_group_port_open(master_security_group, 8888):
-                    cloud_account.authorize_security_group_ingress(master_security_group, 8888,
-                                                                   "Jupyter Notebook")
-                # Check and open Spark HistoryServer port
-                if not cloud_account.get_security_group_port_open(master_security_group, 18080):
-                    cloud_account.authorize_security_group_ingress(master_security_group, 18080,
-                                                                   "Spark HistoryServer")
-
-    if "ssh_key" in credentials.credentials[account]:
+    account_credentials = credentials.get(account)
+    if "ssh_key" in account_credentials:
         # Check if the file exists
-        if os.path.isfile(credentials.credentials[account]["ssh_key"]):
-            ssh_key = credentials.credentials[account]["ssh_key"]
+        if os.path.isfile(account_credentials["ssh_key"]):
+            ssh_key = account_credentials["ssh_key"]
 
     data = {
         'account': account,
+        'region': _region_arg(),
+        'region_name': _region(),
+        'region_query': "?region=%s" % _region_arg() if _region_arg() else "",
         'cluster_name': cluster_info['Name'],
         'cluster_id': cluster_id,
         'master_url': master_public_dns_name,
@@ -334,21 +590,115 @@ def cluster_details(account, cluster_id):
     return render_template("emr-details.html", data=data, error=error)
 
 
+def _check_logs_bucket(cloud_account):
+    logs_bucket_name = None
+    try:
+        logs_bucket_name = "aws-logs-%s-%s" % (cloud_account.get_account_id(),
+                                               cloud_account.region_name)
+        cloud_account.head_s3_bucket(logs_bucket_name)
+    except AWSException as e:
+        return logs_bucket_name, e.msg
+    return logs_bucket_name, None
+
+
+@app.route('/g/<account>/<cluster_id>/events', methods=["GET"])
+def cluster_events(account, cluster_id):
+    cloud_account = _cloud_account(account)
+
+    def stream():
+        # Server-sent events: one event per state or master DNS name change, with comments in
+        # between to keep the connection open. The stream ends after EVENT_STREAM_SECONDS and
+        # the browser opens a new one, which starts with the current status.
+        deadline = time.time() + EVENT_STREAM_SECONDS
+        watcher = watchers.subscribe(account, cluster_id, cloud_account)
+        try:
+            yield "retry: %d\n\n" % EVENT_STREAM_RETRY
+            version = 0
+            while True:
+                new_version, status = watcher.wait(version,
+                                                   timeout=max(0, min(15, deadline - time.time())))
+                if new_version != version:
+                    version = new_version
+                    yield "data: %s\n\n" % json.dumps(status)
+                elif watcher.finished or time.time() >= deadline:
+                    break
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            watchers.unsubscribe(account, cluster_id, watcher)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+
 @app.route('/destroy/<account>/<cluster_id>', methods=["POST"])
 def destroy_cluster(account, cluster_id):
-    cloud_account = AWS(credentials.credentials[account]["access_key_id"],
-                        credentials.credentials[account]["secret_access_key"],
-                        config.config["emr"]["region"])
+    cloud_account = _cloud_account(account)
 
     try:
         cloud_account.terminate_cluster(cluster_id)
+        pollers.poll(account)
 
-        return redirect(url_for('cluster_list_create', account=account))
+        return redirect(url_for('cluster_list_create', account=account, region=_region_arg()))
     except AWSException as e:
         data = {}
         return render_template("emr-details.html", data=data, error=e.msg)
 
 
+@app.route('/destroy/<account>', methods=["POST"])
+def destroy_clusters(account):
+    cloud_account = _cloud_account(account)
+
+    cluster_ids = request.form.getlist("cluster_id")
+
+    try:
+        cloud_account.terminate_clusters(cluster_ids)
+        pollers.poll(account)
+        flash("Clusters terminated: %d" % len(cluster_ids))
+
+        return redirect(url_for('cluster_list_create', account=account, region=_region_arg()))
+    except AWSException as e:
+        data = {}
+        return render_template("emr-details.html", data=data, error=e.msg)
+
+
+@app.route('/sweep/<account>', methods=["POST"])
+def sweep_idle_clusters(account):
+    cloud_account = _cloud_account(account)
+
+    idle_hours = config.config["emr"]["idle-hours"]
+    if request.form.get("idle_hours", "") != "":
+        idle_hours = request.form["idle_hours"]
+
+    try:
+        idle_hours = float(idle_hours)
+    except ValueError:
+        idle_hours = 0
+    if not idle_hours > 0:
+        flash("The number of hours after which a cluster is idle must be a positive number")
+        return redirect(url_for('cluster_list_create', account=account, region=_region_arg()))
+
+    # Only the clusters launched by this account are terminated
+    try:
+        cluster_ids = cloud_account.find_idle_clusters(idle_hours * 3600,
+                                                       owner=_account_owner(account))
+        if cluster_ids:
+            cloud_account.terminate_clusters(cluster_ids)
+            pollers.poll(account)
+        flash("Idle clusters terminated: %d" % len(cluster_ids))
+
+        return redirect(url_for('cluster_list_create', account=account, region=_region_arg()))
+    except AWSException as e:
+        data = {}
+        return render_template("emr-details.html", data=data, error=e.msg)
+
+
+@app.route('/stats', methods=['GET'])
+def throttle_stats():
+    # Counters of the AWS calls made, throttled and retried since the server started
+    return jsonify(stats.as_dict())
+
+
 @app.errorhandler(IOError)
 def handle_ioerror(e):
     return str(e)
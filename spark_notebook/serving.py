@@ -0,0 +1,32 @@
+import signal
+import sys
+
+import waitress
+
+# Threads serving requests and seconds an idle keep-alive connection is held open. Every open
+# cluster details page of a starting cluster holds a thread with its event stream, for up to
+# EVENT_STREAM_SECONDS at a time, so serve more threads than pages watched at once.
+THREADS = 8
+KEEP_ALIVE = 30
+
+
+def create_server(app, host, port, threads=THREADS, keep_alive=KEEP_ALIVE):
+    # A production WSGI server that handles every request on a fixed pool of `threads` threads
+    # and keeps HTTP/1.1 connections open until they have been idle for `keep_alive` seconds.
+    # All the threads share the pollers, watchers and caches of this process, which is why the
+    # workers are threads and not processes.
+    return waitress.create_server(app, host=host, port=port, threads=threads,
+                                  channel_timeout=keep_alive, ident="spark-notebook")
+
+
+def serve(app, host, port, threads=THREADS, keep_alive=KEEP_ALIVE, reload=None):
+    # Serve app until SIGINT or SIGTERM, giving the requests in flight a chance to finish.
+    # SIGHUP calls reload, where the platform has it, without dropping any connection.
+    server = create_server(app, host, port, threads=threads, keep_alive=keep_alive)
+
+    # waitress shuts its threads down cleanly on SystemExit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if reload is not None and hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload())
+
+    server.run()
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+# noinspection PyPackageRequirements
+import yaml
+
+# The safe loader of libyaml when PyYAML was built with it, which parses several times faster
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Seconds between checks of the file for changes made outside of the app
+CHECK_INTERVAL = 1
+
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=Loader)
+
+
+def _stamp(file_path):
+    # The modification time and size of the file, or None if it does not exist
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class YAMLFile:
+    """A YAML file whose parsed contents are published as a snapshot that is never modified.
+
+    Subclasses read and write the file with `_read` and `_write`. Every change builds a new
+    snapshot and swaps it in whole, so readers never block. Writers are serialized by a lock.
+    The file is only parsed again when its modification time or size changes. Readers check
+    this at most every `CHECK_INTERVAL` seconds, so the app picks up edits made outside it
+    without a restart.
+    """
+
+    def __init__(self, file_path, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._checked = clock()
+        stamp = _stamp(file_path)
+        self._snapshot = (file_path, self._read(file_path), stamp)
+
+    @property
+    def file_path(self):
+        return self._snapshot[0]
+
+    def load(self, file_path=None):
+        # Read the file again if it has changed, or switch to a different file if file_path is
+        # given
+        with self._lock:
+            self._reload(file_path or self.file_path)
+
+    def save(self):
+        with self._lock:
+            self._swap(self.file_path, self._snapshot[1])
+
+    def _data(self):
+        # The latest snapshot. A reader that finds another thread already checking the file
+        # gets the current snapshot instead of waiting.
+        if self.clock() - self._checked >= CHECK_INTERVAL and self._lock.acquire(False):
+            try:
+                self._reload(self.file_path)
+            finally:
+                self._lock.release()
+        return self._snapshot[1]
+
+    def _reload(self, file_path):
+        # Parse the file again if it is a different file or it has changed. Must hold the lock.
+        self._checked = self.clock()
+        stamp = _stamp(file_path)
+        if (file_path, stamp) != (self._snapshot[0], self._snapshot[2]):
+            self._snapshot = (file_path, self._read(file_path), stamp)
+
+    def _swap(self, file_path, data):
+        # Write data to file_path and publish it. Must hold the lock.
+        self._write(file_path, data)
+        self._snapshot = (file_path, data, _stamp(file_path))
+
+    def _read(self, file_path):
+        raise NotImplementedError
+
+    def _write(self, file_path, data):
+        raise NotImplementedError
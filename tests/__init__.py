@@ -0,0 +1,17 @@
+import unittest
+from spark_notebook.cloud.cache import cache
+from spark_notebook.cloud.client_pool import client_pool
+
+
+class IsolatedTestCase(unittest.TestCase):
+    """A test case that starts without the boto3 clients and AWS answers of other tests.
+
+    The client pool and the cache are shared by the whole process, so a client built by an
+    earlier test would bypass the patched boto3.client. They are reset before every test, ahead
+    of setUp, so test cases do not have to do it themselves.
+    """
+
+    def run(self, result=None):
+        client_pool.clear()
+        cache.clear()
+        return super(IsolatedTestCase, self).run(result)
@@ -91,8 +91,16 @@ class FakeBotoClient(object):
     def list_bootstrap_actions(ClusterId):
         return {}
 
-    def list_clusters(self):
-        return self.cluster_list
+    @staticmethod
+    def get_metric_statistics(*args, **kwargs):
+        return {'Datapoints': []}
+
+    def list_clusters(self, ClusterStates=None, Marker=None, **kwargs):
+        if self.cluster_list is None:
+            return {'Clusters': []}
+        clusters = [c for c in self.cluster_list["Clusters"]
+                    if ClusterStates is None or c["Status"]["State"] in ClusterStates]
+        return {'Clusters': clusters}
 
     @staticmethod
     def describe_security_groups(*args, **kwargs):
@@ -101,14 +109,17 @@ class FakeBotoClient(object):
                 {
                     "IpPermissions": [
                         {
+                            "IpProtocol": "tcp",
                             "FromPort": 22,
                             "ToPort": 22,
                         },
                         {
+                            "IpProtocol": "tcp",
                             "FromPort": 8088,
                             "ToPort": 8088,
                         },
                         {
+                            "IpProtocol": "tcp",
                             "FromPort": 8888,
                             "ToPort": 8888,
                         },
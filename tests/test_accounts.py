@@ -6,10 +6,11 @@ import yaml
 from flask import url_for
 from mock import patch
 from spark_notebook.server import app
+from tests import IsolatedTestCase
 from tests import fake_boto
 
 
-class SparkNotebookTestCase(unittest.TestCase):
+class SparkNotebookTestCase(IsolatedTestCase):
 
     def setUp(self):
         self.maxDiff = None
@@ -127,13 +128,13 @@ class SparkNotebookTestCase(unittest.TestCase):
             # Verify the saved temp_credentials_file matches the expected output
             if os.path.isfile(self.temp_credentials_file):
                 with open(self.temp_credentials_file, 'r') as stream:
-                    temp_credentials_yaml = yaml.load(stream)
+                    temp_credentials_yaml = yaml.safe_load(stream)
             else:
                 self.fail("Missing: %s " % self.temp_credentials_file)
 
             if os.path.isfile(self.good_credentials_file):
                 with open(self.good_credentials_file, 'r') as stream:
-                    good_credentials_yaml = yaml.load(stream)
+                    good_credentials_yaml = yaml.safe_load(stream)
             else:
                 self.fail("Missing: %s " % self.good_credentials_file)
 
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+import botocore.exceptions
+import datetime
+import unittest
+from mock import patch
+from spark_notebook.cloud.aws import AWS
+from spark_notebook.cloud.aws import build_launch_template
+from tests import IsolatedTestCase
+from tests import fake_boto
+
+
+class AWSTestCase(IsolatedTestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+
+        self.cloud_account = AWS("access_key_id", "secret_access_key", "us-east-1")
+
+    def tearDown(self):
+        pass
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'describe_security_groups')
+    @patch.object(fake_boto.FakeBotoClient, 'authorize_security_group_ingress')
+    def test_open_security_group_ports(self, mock_authorize, mock_describe):
+        mock_describe.return_value = {
+            "SecurityGroups": [{
+                "IpPermissions": [
+                    {"IpProtocol": "tcp", "FromPort": 22, "ToPort": 22,
+                     "IpRanges": [{"CidrIp": "0.0.0.0/0"}]},
+                    {"IpProtocol": "tcp", "FromPort": 8000, "ToPort": 8100,
+                     "IpRanges": [{"CidrIp": "0.0.0.0/0"}]},
+                    {"IpProtocol": "udp", "FromPort": 18080, "ToPort": 18080,
+                     "IpRanges": [{"CidrIp": "0.0.0.0/0"}]},
+                ]
+            }]
+        }
+
+        ports = [(22, "SSH"), (8088, "YARN ResourceManager"), (8888, "Jupyter Notebook"),
+                 (18080, "Spark HistoryServer")]
+        opened = self.cloud_account.open_security_group_ports("sg-1234567a", ports)
+
+        # Only the ports that are not covered by a TCP range are opened, in a single request
+        self.assertEqual(opened, [8888, 18080])
+        self.assertEqual(mock_describe.call_count, 1)
+        self.assertEqual(mock_authorize.call_count, 1)
+        self.assertEqual([p["FromPort"] for p in mock_authorize.call_args[1]["IpPermissions"]],
+                         [8888, 18080])
+
+        # Nothing is authorized when every port is already open
+        mock_describe.return_value = {
+            "SecurityGroups": [{"IpPermissions": [{"IpProtocol": "-1",
+                                                   "IpRanges": [{"CidrIp": "0.0.0.0/0"}]}]}]
+        }
+        self.assertEqual(self.cloud_account.open_security_group_ports("sg-1234567a", ports), [])
+        self.assertEqual(mock_authorize.call_count, 1)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'describe_security_groups')
+    @patch.object(fake_boto.FakeBotoClient, 'authorize_security_group_ingress')
+    def test_open_security_group_ports_duplicate(self, mock_authorize, mock_describe):
+        mock_describe.return_value = {"SecurityGroups": [{"IpPermissions": []}]}
+        duplicate = {'Error': {'Code': 'InvalidPermission.Duplicate', 'Message': 'Duplicate'}}
+
+        def authorize(GroupId, IpPermissions):
+            # Another request opened port 22 since the group was described
+            if 22 in [ip_permission["FromPort"] for ip_permission in IpPermissions]:
+                raise botocore.exceptions.ClientError(duplicate, "ec2")
+
+        mock_authorize.side_effect = authorize
+
+        ports = [(22, "SSH"), (8888, "Jupyter Notebook")]
+        opened = self.cloud_account.open_security_group_ports("sg-1234567a", ports)
+        self.assertEqual(opened, [8888])
+        self.assertEqual(mock_authorize.call_count, 3)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'describe_security_groups')
+    @patch.object(fake_boto.FakeBotoClient, 'authorize_security_group_ingress')
+    def test_open_security_group_ports_group_source(self, mock_authorize, mock_describe):
+        # The rules EMR adds to its managed master security group only open the ports to the
+        # master and slave security groups
+        mock_describe.return_value = {
+            "SecurityGroups": [{
+                "IpPermissions": [
+                    {"IpProtocol": "tcp", "FromPort": 0, "ToPort": 65535, "IpRanges": [],
+                     "UserIdGroupPairs": [{"GroupId": "sg-master"}, {"GroupId": "sg-slave"}]},
+                    {"IpProtocol": "tcp", "FromPort": 8443, "ToPort": 8443,
+                     "IpRanges": [{"CidrIp": "10.0.0.0/8"}]},
+                ]
+            }]
+        }
+
+        ports = [(22, "SSH"), (8443, "Web proxy"), (8888, "Jupyter Notebook")]
+        opened = self.cloud_account.open_security_group_ports("sg-1234567a", ports)
+        self.assertEqual(opened, [22, 8443, 8888])
+        self.assertEqual(mock_authorize.call_count, 1)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'get_caller_identity')
+    @patch.object(fake_boto.FakeBotoClient, 'head_bucket')
+    def test_cached_account_checks(self, mock_head_bucket, mock_get_caller_identity):
+        mock_get_caller_identity.return_value = {"Arn": "arn", 'Account': '123456789012'}
+
+        # The account id is fetched once and then served from the cache
+        self.assertEqual(self.cloud_account.get_account_id(), '123456789012')
+        self.assertEqual(self.cloud_account.get_account_id(), '123456789012')
+        self.assertEqual(mock_get_caller_identity.call_count, 1)
+
+        # Successful bucket checks are cached per bucket
+        self.cloud_account.head_s3_bucket("aws-logs-123456789012-us-east-1")
+        self.cloud_account.head_s3_bucket("aws-logs-123456789012-us-east-1")
+        self.cloud_account.head_s3_bucket("other-bucket")
+        self.assertEqual(mock_head_bucket.call_count, 2)
+
+        # Another region does not share the cached answers
+        AWS("access_key_id", "secret_access_key", "us-west-2").get_account_id()
+        self.assertEqual(mock_get_caller_identity.call_count, 2)
+
+        # Invalidating the cache forces the calls to be made again
+        self.cloud_account.invalidate_cache()
+        self.cloud_account.get_account_id()
+        self.cloud_account.head_s3_bucket("aws-logs-123456789012-us-east-1")
+        self.assertEqual(mock_get_caller_identity.call_count, 3)
+        self.assertEqual(mock_head_bucket.call_count, 3)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'list_clusters')
+    def test_iter_clusters(self, mock_list_clusters):
+        mock_list_clusters.side_effect = [
+            {'Clusters': [{'Id': 'J-1'}, {'Id': 'J-2'}], 'Marker': 'page-2'},
+            {'Clusters': [{'Id': 'J-3'}], 'Marker': 'page-3'},
+            {'Clusters': [{'Id': 'J-4'}]},
+        ]
+
+        # Every page is followed and the state filter is passed to EMR
+        clusters = self.cloud_account.list_clusters(states=["WAITING"])
+        self.assertEqual([c['Id'] for c in clusters['Clusters']], ['J-1', 'J-2', 'J-3', 'J-4'])
+        self.assertEqual(mock_list_clusters.call_args_list[0][1], {'ClusterStates': ['WAITING']})
+        self.assertEqual(mock_list_clusters.call_args_list[2][1],
+                         {'ClusterStates': ['WAITING'], 'Marker': 'page-3'})
+
+        # Pages past the limit are not requested
+        mock_list_clusters.reset_mock()
+        mock_list_clusters.side_effect = [
+            {'Clusters': [{'Id': 'J-1'}, {'Id': 'J-2'}], 'Marker': 'page-2'},
+            {'Clusters': [{'Id': 'J-3'}]},
+        ]
+        self.assertEqual([c['Id'] for c in self.cloud_account.iter_clusters(limit=2)],
+                         ['J-1', 'J-2'])
+        self.assertEqual(mock_list_clusters.call_count, 1)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'describe_subnets')
+    def test_cached_subnets(self, mock_describe_subnets):
+        mock_describe_subnets.return_value = {'Subnets': [
+            {'SubnetId': 'subnet-c', 'AvailabilityZone': 'us-east-1c', 'VpcId': 'vpc-1'},
+            {'SubnetId': 'subnet-a', 'AvailabilityZone': 'us-east-1a', 'VpcId': 'vpc-2',
+             'Tags': [{'Key': 'team', 'Value': 'dse'}]},
+            {'SubnetId': 'subnet-b', 'AvailabilityZone': 'us-east-1b', 'VpcId': 'vpc-1',
+             'Tags': [{'Key': 'team', 'Value': 'dse'}]},
+        ]}
+
+        self.assertEqual(self.cloud_account.get_cached_subnets(), None)
+
+        # Subnets are sorted by availability zone
+        subnets = self.cloud_account.get_subnets()["Subnets"]
+        self.assertEqual([s['SubnetId'] for s in subnets], ['subnet-a', 'subnet-b', 'subnet-c'])
+
+        # Filters are applied to the cached subnets without calling EC2 again
+        subnets = self.cloud_account.get_subnets(vpc_id='vpc-1')["Subnets"]
+        self.assertEqual([s['SubnetId'] for s in subnets], ['subnet-b', 'subnet-c'])
+        subnets = self.cloud_account.get_subnets(vpc_id='vpc-1', tags={'team': 'dse'})["Subnets"]
+        self.assertEqual([s['SubnetId'] for s in subnets], ['subnet-b'])
+        self.assertEqual(mock_describe_subnets.call_count, 1)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch('time.sleep')
+    @patch.object(fake_boto.FakeBotoClient, 'get_caller_identity')
+    @patch.object(fake_boto.FakeBotoClient, 'run_job_flow')
+    def test_launch_clusters(self, mock_run_job_flow, mock_get_caller_identity, mock_sleep):
+        mock_get_caller_identity.return_value = {"Arn": "arn", 'Account': '123456789012'}
+
+        throttled = {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}
+        failed = {'Error': {'Code': 'ValidationException', 'Message': 'Bad request'}}
+
+        def run_job_flow(**kwargs):
+            # The first launch of workshop-2 is throttled and workshop-3 always fails
+            if kwargs["Name"] == "workshop-2" and not mock_sleep.called:
+                raise botocore.exceptions.ClientError(throttled, "emr")
+            if kwargs["Name"] == "workshop-3":
+                raise botocore.exceptions.ClientError(failed, "emr")
+            return {'JobFlowId': 'J-' + kwargs["Name"]}
+
+        mock_run_job_flow.side_effect = run_job_flow
+
+        launch_template = build_launch_template("r4.xlarge", 1, False, None, None, "3",
+                                                "password")
+        job_flow_ids, errors = self.cloud_account.launch_clusters(
+            launch_template, 3, "workshop-{index}", "key_name", "subnet-12345678", [])
+
+        # Throttled launches are retried, other failures are reported
+        self.assertEqual(sorted(job_flow_ids), ['J-workshop-1', 'J-workshop-2'])
+        self.assertEqual(errors, ["There was an error creating a new EMR cluster: Bad request"])
+        self.assertEqual(mock_run_job_flow.call_count, 4)
+
+        # The account id was only looked up once for all of the clusters
+        self.assertEqual(mock_get_caller_identity.call_count, 1)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'terminate_job_flows', create=True)
+    def test_terminate_clusters(self, mock_terminate_job_flows):
+        cluster_ids = ['J-%d' % i for i in range(25)]
+        self.cloud_account.terminate_clusters(cluster_ids)
+
+        # The clusters are terminated in batches
+        self.assertEqual([len(c[1]["JobFlowIds"]) for c in mock_terminate_job_flows.call_args_list],
+                         [10, 10, 5])
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch('time.time')
+    @patch.object(fake_boto.FakeBotoClient, 'list_clusters')
+    @patch.object(fake_boto.FakeBotoClient, 'describe_cluster')
+    @patch.object(fake_boto.FakeBotoClient, 'get_metric_statistics')
+    def test_find_idle_clusters(self, mock_get_metric_statistics, mock_describe_cluster,
+                                mock_list_clusters, mock_time):
+        mock_time.return_value = 36000
+
+        def summary(cluster_id, ready_hour):
+            ready = datetime.datetime.utcfromtimestamp(ready_hour * 3600)
+            return {'Id': cluster_id, 'Status': {'State': 'WAITING',
+                                                 'Timeline': {'ReadyDateTime': ready}}}
+
+        mock_list_clusters.return_value = {'Clusters': [
+            summary('J-old-mine', 1), summary('J-old-other', 1), summary('J-old-untagged', 1),
+            summary('J-recent', 9)]}
+
+        tags = {'J-old-mine': [{'Key': 'cluster', 'Value': 'test-4@email'}],
+                'J-old-other': [{'Key': 'cluster', 'Value': 'other@email'}],
+                'J-old-untagged': []}
+        mock_describe_cluster.side_effect = \
+            lambda ClusterId: {'Cluster': {'Id': ClusterId, 'Tags': tags[ClusterId]}}
+
+        is_idle = {'J-old-mine': [1, 1, 1], 'J-old-other': [1, 1, 1]}
+        mock_get_metric_statistics.side_effect = lambda **kwargs: {'Datapoints': [
+            {'Minimum': value} for value in is_idle[kwargs['Dimensions'][0]['Value']]]}
+
+        # Only tagged clusters idle for longer than the idle time are returned
+        self.assertEqual(self.cloud_account.find_idle_clusters(4 * 3600),
+                         ['J-old-mine', 'J-old-other'])
+        self.assertEqual(self.cloud_account.find_idle_clusters(4 * 3600, owner='test-4@email'),
+                         ['J-old-mine'])
+        self.assertEqual(mock_list_clusters.call_args[1], {'ClusterStates': ['WAITING']})
+        request = mock_get_metric_statistics.call_args[1]
+        self.assertEqual((request['MetricName'], request['Period']), ('IsIdle', 300))
+        self.assertEqual(request['EndTime'] - request['StartTime'], datetime.timedelta(hours=4))
+
+        # A cluster that was busy during the window, or has no metrics yet, is kept
+        is_idle['J-old-other'] = [1, 0, 1]
+        self.assertEqual(self.cloud_account.find_idle_clusters(4 * 3600), ['J-old-mine'])
+        is_idle['J-old-other'] = []
+        self.assertEqual(self.cloud_account.find_idle_clusters(4 * 3600), ['J-old-mine'])
+        is_idle['J-old-other'] = [1, 1, 1]
+
+        # A cluster that cannot be described any more is skipped instead of ending the sweep
+        del tags['J-old-other']
+        self.assertEqual(self.cloud_account.find_idle_clusters(4 * 3600), ['J-old-mine'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import unittest
+from mock import patch
+from spark_notebook.cloud.aws import AWS
+from spark_notebook.cloud.aws import build_launch_template
+from spark_notebook.exceptions import AWSException
+from tests import IsolatedTestCase
+from tests import fake_boto
+
+try:
+    import asyncio
+    from spark_notebook.cloud import aws_async
+except (ImportError, SyntaxError):
+    asyncio = None
+
+
+@unittest.skipIf(asyncio is None, "asyncio is not available")
+class AsyncAWSTestCase(IsolatedTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'list_clusters')
+    def test_list_clusters(self, mock_list_clusters):
+        def list_clusters(**kwargs):
+            if "ClusterStates" in kwargs:
+                return {'Clusters': [{'Id': 'J-1'}]}
+            raise Exception("Failed")
+
+        mock_list_clusters.side_effect = list_clusters
+
+        accounts = [aws_async.AsyncAWS("access_key_id", "secret_access_key", region,
+                                       loop=self.loop)
+                    for region in ["us-east-1", "us-west-2"]]
+
+        results = self.loop.run_until_complete(
+            aws_async.list_clusters(accounts, states=["WAITING"]))
+        self.assertEqual(results, [{'Clusters': [{'Id': 'J-1'}]}, {'Clusters': [{'Id': 'J-1'}]}])
+
+        # Errors are returned in place of the failed account's clusters
+        results = self.loop.run_until_complete(aws_async.list_clusters(accounts))
+        assert all(isinstance(result, AWSException) for result in results)
+
+    def test_same_operations(self):
+        # Every public method of AWS has an asynchronous counterpart
+        names = [name for name in dir(AWS) if not name.startswith("_")]
+        missing = [name for name in names if not hasattr(aws_async.AsyncAWS, name)]
+        self.assertEqual(missing, [])
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'run_job_flow')
+    def test_launch_clusters(self, mock_run_job_flow):
+        mock_run_job_flow.return_value = {'JobFlowId': 'J-1'}
+        cloud_account = aws_async.AsyncAWS("access_key_id", "secret_access_key", "us-east-1",
+                                           loop=self.loop)
+        launch_template = build_launch_template("m4.xlarge", 1, False, None, None, "3",
+                                                "password")
+
+        cluster_ids, errors = self.loop.run_until_complete(
+            cloud_account.launch_clusters(launch_template, 2, "workshop", "key_name",
+                                          "subnet-12345678", []))
+        self.assertEqual((cluster_ids, errors), (['J-1', 'J-1'], []))
+        self.assertEqual(mock_run_job_flow.call_count, 2)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    def test_describe_clusters(self):
+        cloud_account = aws_async.AsyncAWS("access_key_id", "secret_access_key", "us-east-1",
+                                           loop=self.loop)
+
+        results = self.loop.run_until_complete(
+            aws_async.describe_clusters(cloud_account, ["J-1", "J-2"]))
+        self.assertEqual([result["Cluster"]["Name"] for result in results],
+                         ["expected-cluster", "expected-cluster"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import unittest
+from mock import Mock
+from mock import patch
+from spark_notebook.cloud.client_pool import ClientPool
+from tests import fake_boto
+
+
+class ClientPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ClientPool(max_idle=60)
+
+    def tearDown(self):
+        pass
+
+    @patch('boto3.client')
+    def test_retries_disabled(self, mock_client):
+        self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-east-1')
+
+        # ThrottledClient is the only retry policy, so botocore makes a single attempt
+        self.assertEqual(mock_client.call_args[1]['config'].retries, {'max_attempts': 0})
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    def test_client_reuse(self):
+        emr = self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-east-1')
+
+        # The same key returns the same client
+        assert self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-east-1') is emr
+
+        # A different service, region or key returns a new client
+        assert self.pool.get('ec2', 'access_key_id', 'secret_access_key', 'us-east-1') is not emr
+        assert self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-west-2') is not emr
+        assert self.pool.get('emr', 'other_key_id', 'secret_access_key', 'us-east-1') is not emr
+
+        self.assertEqual(len(self.pool), 4)
+
+        self.pool.clear()
+        self.assertEqual(len(self.pool), 0)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    def test_idle_eviction(self):
+        mock_time = Mock(return_value=0)
+        self.pool.clock = mock_time
+
+        emr = self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-east-1')
+        self.pool.get('ec2', 'access_key_id', 'secret_access_key', 'us-east-1')
+
+        # Using the EMR client keeps it alive
+        mock_time.return_value = 50
+        assert self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-east-1') is emr
+
+        # The EC2 client has been idle for more than max_idle and is evicted
+        mock_time.return_value = 100
+        assert self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-east-1') is emr
+        self.assertEqual(len(self.pool), 1)
+
+        # The EMR client is rebuilt after it has been idle for too long
+        mock_time.return_value = 200
+        assert self.pool.get('emr', 'access_key_id', 'secret_access_key', 'us-east-1') is not emr
+
+
+if __name__ == '__main__':
+    unittest.main()
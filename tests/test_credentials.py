@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sqlite3
+import stat
+import tempfile
+import threading
+import unittest
+import yaml
+from mock import Mock
+from mock import patch
+from spark_notebook.config import Config
+from spark_notebook.credentials import Credentials
+from spark_notebook.credentials import SQLiteCredentials
+from spark_notebook.credentials import migrate
+from spark_notebook.exceptions import CredentialsException
+
+
+class CredentialsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.credentials_file = os.path.join(self.temp_dir, "credentials.yaml")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_concurrent_add(self):
+        credentials = Credentials(self.credentials_file)
+        before = credentials.credentials
+
+        def add(index):
+            credentials.add("account-%d" % index, "user%d@example.com" % index,
+                            "access_key_id", "secret_access_key", "key_name", "ssh_key")
+
+        # The file is only written, never read back, while accounts are added
+        with patch('yaml.load') as mock_load:
+            threads = [threading.Thread(target=add, args=(index,)) for index in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(mock_load.call_count, 0)
+
+        # No account was lost and the snapshot taken before the changes was left alone
+        self.assertEqual(len(credentials.credentials), 20)
+        self.assertEqual(before, dict())
+        with open(self.credentials_file, 'r') as stream:
+            self.assertEqual(len(yaml.safe_load(stream)), 20)
+
+    def test_failed_write(self):
+        credentials = Credentials(self.credentials_file)
+        credentials.add("account", "user@example.com", "access_key_id", "secret_access_key",
+                        "key_name", "ssh_key")
+        snapshot = credentials.credentials
+
+        # Nothing changes when the credentials file cannot be written
+        with self.assertRaises(CredentialsException):
+            credentials.use(os.path.join(self.temp_dir, "missing", "credentials.yaml"))
+        assert credentials.credentials is snapshot
+        self.assertEqual(credentials.file_path, self.credentials_file)
+
+    def test_file_mode(self):
+        credentials = Credentials(self.credentials_file)
+        credentials.add("account", "user@example.com", "access_key_id", "secret_access_key",
+                        "key_name", "ssh_key")
+
+        # New credentials files are only readable by their owner, and rewriting a file keeps
+        # its permissions
+        self.assertEqual(stat.S_IMODE(os.stat(self.credentials_file).st_mode), 0o600)
+        os.chmod(self.credentials_file, 0o640)
+        credentials.add("other", "user@example.com", "access_key_id", "secret_access_key",
+                        "key_name", "ssh_key")
+        self.assertEqual(stat.S_IMODE(os.stat(self.credentials_file).st_mode), 0o640)
+
+        database_file = os.path.join(self.temp_dir, "credentials.db")
+        migrate(self.credentials_file, database_file)
+        self.assertEqual(stat.S_IMODE(os.stat(database_file).st_mode), 0o600)
+
+    def test_lazy_reload(self):
+        with open(self.credentials_file, 'w') as stream:
+            stream.write(yaml.safe_dump({"account": {"email_address": "user@example.com"}}))
+
+        mock_time = Mock(return_value=0)
+        credentials = Credentials(self.credentials_file, clock=mock_time)
+
+        # An unchanged file is never parsed again
+        with patch('yaml.load') as mock_load:
+            mock_time.return_value = 10
+            credentials.load()
+            self.assertEqual(credentials.credentials["account"]["email_address"],
+                             "user@example.com")
+            self.assertEqual(mock_load.call_count, 0)
+
+        # A change made to the file outside the app is picked up once it is checked again
+        with open(self.credentials_file, 'w') as stream:
+            stream.write(yaml.safe_dump({"account": {"email_address": "other@example.com"}}))
+        self.assertEqual(credentials.credentials["account"]["email_address"],
+                         "user@example.com")
+        mock_time.return_value = 20
+        self.assertEqual(credentials.credentials["account"]["email_address"],
+                         "other@example.com")
+
+    def test_sqlite(self):
+        database_file = os.path.join(self.temp_dir, "credentials.db")
+        credentials = Credentials(database_file)
+        assert isinstance(credentials._store, SQLiteCredentials)
+        self.assertEqual(credentials.credentials, dict())
+
+        credentials.add("account-1", "user@example.com", "access_key_id", "secret_access_key",
+                        "key-1", None)
+        credentials.add("account-2", "user@example.com", "access_key_id", "secret_access_key",
+                        "key-2", "/tmp/key-2.pem")
+
+        # Missing settings are left out like in the YAML file
+        self.assertEqual(credentials.get("account-1"),
+                         dict(email_address="user@example.com", access_key_id="access_key_id",
+                              secret_access_key="secret_access_key", key_name="key-1"))
+        self.assertEqual(credentials.get("account-2")["ssh_key"], "/tmp/key-2.pem")
+        with self.assertRaises(KeyError):
+            credentials.get("account-3")
+
+        self.assertEqual(credentials.find(email_address="user@example.com"),
+                         ["account-1", "account-2"])
+        self.assertEqual(credentials.find(key_name="key-2"), ["account-2"])
+
+        # Replacing an account leaves the others alone
+        credentials.add("account-1", "other@example.com", "access_key_id", "secret_access_key",
+                        "key-1", None)
+        self.assertEqual(credentials.find(email_address="user@example.com"), ["account-2"])
+        self.assertEqual(len(credentials.credentials), 2)
+
+    def test_migrate(self):
+        credentials = Credentials(self.credentials_file)
+        credentials.add("account", "user@example.com", "access_key_id", "secret_access_key",
+                        "key_name", "ssh_key")
+
+        database_file = os.path.join(self.temp_dir, "credentials.sqlite")
+        self.assertEqual(migrate(self.credentials_file, database_file), 1)
+
+        # Using the database switches to the SQLite store with the migrated accounts
+        credentials.use(database_file)
+        assert isinstance(credentials._store, SQLiteCredentials)
+        self.assertEqual(credentials.credentials["account"]["email_address"],
+                         "user@example.com")
+
+    def test_migrate_relative_path(self):
+        credentials = Credentials(self.credentials_file)
+        credentials.add("account", "user@example.com", "access_key_id", "secret_access_key",
+                        "key_name", "ssh_key")
+
+        # Bare file names are in the current directory
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            self.assertEqual(migrate("credentials.yaml", "credentials.db"), 1)
+            self.assertEqual(Credentials("credentials.db").find(email_address="user@example.com"),
+                             ["account"])
+        finally:
+            os.chdir(cwd)
+
+    def test_sqlite_read_only(self):
+        database_file = os.path.join(self.temp_dir, "credentials.db")
+        credentials = Credentials(database_file)
+        credentials.add("account", "user@example.com", "access_key_id", "secret_access_key",
+                        "key_name", None)
+
+        # Reading works on a database opened read-only, as it does not create anything
+        def connect_read_only(file_path):
+            return sqlite3.connect("file:%s?mode=ro" % file_path, uri=True)
+
+        with patch.object(SQLiteCredentials, '_connect', side_effect=connect_read_only):
+            self.assertEqual(Credentials(database_file).get("account")["key_name"], "key_name")
+
+        # A database without accounts yet reads as empty
+        open(os.path.join(self.temp_dir, "empty.db"), "w").close()
+        self.assertEqual(Credentials(os.path.join(self.temp_dir, "empty.db")).credentials, {})
+
+    def test_config_set(self):
+        config_file = os.path.join(self.temp_dir, "config.yaml")
+        config = Config(file_path=config_file)
+        snapshot = config.config
+
+        config.set("credentials", "path", self.credentials_file)
+
+        # The change is swapped in as a new snapshot and saved
+        self.assertEqual(config.config["credentials"]["path"], self.credentials_file)
+        self.assertEqual(snapshot["credentials"]["path"], "./credential.yaml")
+        with open(config_file, 'r') as stream:
+            self.assertEqual(yaml.safe_load(stream)["credentials"]["path"],
+                             self.credentials_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import unittest
+from flask import url_for
+from mock import patch
+from spark_notebook.cloud.scanner import list_account_clusters
+from spark_notebook.server import app
+from tests import IsolatedTestCase
+from tests import fake_boto
+
+
+class SparkNotebookTestCase(IsolatedTestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+
+        self.test_config_file = "./tests/test_files/test_config.yaml"
+
+    def tearDown(self):
+        pass
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'list_clusters')
+    def test_dashboard(self, mock_list_clusters):
+        mock_list_clusters.return_value = {
+            'Clusters': [{'Id': 'J-waiting-cluster',
+                          'Name': 'waiting-cluster',
+                          'Status': {'State': 'WAITING'}}]
+        }
+
+        with app.test_client() as c:
+            c.get('/?config_path=%s' % self.test_config_file)
+
+            rv = c.get(url_for('dashboard', region=["us-east-1", "us-west-2"]))
+
+            # Make sure there were no errors
+            assert '<p class="error"><strong>Error:</strong>' not in rv.data.decode('utf-8')
+
+            # The cluster is listed once per region that was scanned, and links to other
+            # regions than the configured one carry the region
+            assert 'Region: us-east-1, us-west-2' in rv.data.decode('utf-8')
+            assert '<a href="/g/test-4/J-waiting-cluster">waiting-cluster</a>' \
+                in rv.data.decode('utf-8')
+            assert '<a href="/g/test-4/J-waiting-cluster?region=us-west-2">waiting-cluster</a>' \
+                in rv.data.decode('utf-8')
+            self.assertEqual(mock_list_clusters.call_count, 2)
+
+            # Each region is cached on its own
+            c.get(url_for('dashboard', region=["us-east-1", "us-west-2"]))
+            self.assertEqual(mock_list_clusters.call_count, 2)
+            c.get(url_for('dashboard', region=["us-west-2", "eu-west-1"]))
+            self.assertEqual(mock_list_clusters.call_count, 3)
+
+            # The cluster pages follow the region of the request
+            rv = c.get(url_for('cluster_details', account="test-4", cluster_id="J-waiting-cluster",
+                               region="us-west-2"))
+            assert 'Account: <a href="/g/test-4?region=us-west-2">test-4</a>' \
+                in rv.data.decode('utf-8')
+
+            # Subnets can be listed across regions
+            rv = c.get(url_for('subnets_json', account="test-4", region=["us-east-1", "us-west-2"]))
+            self.assertEqual([subnet["region"] for subnet in rv.get_json()["subnets"]],
+                             ["us-east-1"] * 3 + ["us-west-2"] * 3)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'list_clusters')
+    def test_shared_keys(self, mock_list_clusters):
+        mock_list_clusters.return_value = {'Clusters': []}
+        account = {"access_key_id": "access_key_id", "secret_access_key": "secret_access_key"}
+
+        # Accounts with the same keys share the cached clusters but keep their own names
+        results = list_account_clusters({"first": account, "second": account}, ["us-east-1"])
+        self.assertEqual([result["account"] for result in results], ["first", "second"])
+        results = list_account_clusters({"second": account}, ["us-east-1"])
+        self.assertEqual([result["account"] for result in results], ["second"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,11 @@ import unittest
 from flask import url_for
 from mock import patch
 from spark_notebook.server import app
+from tests import IsolatedTestCase
 from tests import fake_boto
 
 
-class SparkNotebookTestCase(unittest.TestCase):
+class SparkNotebookTestCase(IsolatedTestCase):
 
     def setUp(self):
         self.maxDiff = None
@@ -125,6 +126,30 @@ class SparkNotebookTestCase(unittest.TestCase):
             assert 'Cluster: terminated-cluster' in rv.data.decode('utf-8')
             assert 'State: TERMINATED' in rv.data.decode('utf-8')
 
+            # Test that the events stream reports the final state and then ends
+            rv = c.get(url_for('cluster_events', account="test-4",
+                               cluster_id="J-terminated-cluster"))
+            self.assertEqual(rv.mimetype, 'text/event-stream')
+            assert 'data: {' in rv.data.decode('utf-8')
+            assert '"state": "TERMINATED"' in rv.data.decode('utf-8')
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'describe_cluster')
+    @patch('spark_notebook.server.EVENT_STREAM_SECONDS', 0.5)
+    def test_events_reconnect(self, mock_describe_cluster):
+        mock_describe_cluster.return_value = {
+            'Cluster': {'Id': 'J-starting-cluster', 'Status': {'State': 'STARTING'}}}
+
+        with app.test_client() as c:
+            c.get('/?config_path=%s' % self.test_config_file)
+
+            # The stream of a cluster that keeps starting ends after EVENT_STREAM_SECONDS and
+            # tells the browser when to reconnect
+            rv = c.get(url_for('cluster_events', account="test-4",
+                               cluster_id="J-starting-cluster"))
+            assert rv.data.decode('utf-8').startswith('retry: 1000\n\n')
+            assert '"state": "STARTING"' in rv.data.decode('utf-8')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,10 +5,11 @@ import unittest
 from flask import url_for
 from mock import patch
 from spark_notebook.server import app
+from tests import IsolatedTestCase
 from tests import fake_boto
 
 
-class SparkNotebookTestCase(unittest.TestCase):
+class SparkNotebookTestCase(IsolatedTestCase):
 
     def setUp(self):
         self.maxDiff = None
@@ -82,6 +83,17 @@ class SparkNotebookTestCase(unittest.TestCase):
             rv = c.get(url_for('cluster_list_create', account="test-4"))
             assert '<p>No clusters are running.</p>' in rv.data.decode('utf-8')
 
+            # The subnets are not cached yet so the page loads them from the JSON endpoint
+            assert 'Loading subnets...' in rv.data.decode('utf-8')
+            rv = c.get(url_for('subnets_json', account="test-4"))
+            self.assertEqual([subnet["availability_zone"] for subnet in rv.get_json()["subnets"]],
+                             ["us-east-1a", "us-east-1b", "us-east-1c"])
+
+            # Once cached the subnets are rendered with the page
+            rv = c.get(url_for('cluster_list_create', account="test-4"))
+            assert '<option value="subnet-12345678">subnet-12345678 - us-east-1a</option>' \
+                in rv.data.decode('utf-8')
+
             #
             # Test launching a spot cluster with pyspark python 3
             #
@@ -172,6 +184,59 @@ class SparkNotebookTestCase(unittest.TestCase):
             assert 'Cluster: cluster-1'
             assert 'Cluster: cluster-2'
 
+            # Test that the launched clusters can be fetched by state from the JSON listing
+            rv = c.get(url_for('cluster_list_json', account="test-4", state="STARTING"))
+            self.assertEqual([cluster["name"] for cluster in rv.get_json()["clusters"]],
+                             ["cluster-1", "cluster-2"])
+
+            rv = c.get(url_for('cluster_list_json', account="test-4", state="TERMINATED"))
+            self.assertEqual(rv.get_json(), {"clusters": [], "marker": None})
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'run_job_flow')
+    def test_invalid_count(self, mock_run_job_flow):
+        with app.test_client() as c:
+            c.get('/?config_path=%s' % self.test_config_file)
+
+            # Counts that are not numbers or above emr:max-clusters are reported, not launched
+            for count in ["many", "0", "11"]:
+                rv = c.post(url_for('cluster_list_create', account="test-4"),
+                            data=dict(name="cluster-{index}", subnet_id="subnet-12345678",
+                                      count=count))
+                self.assertEqual(rv.status_code, 200)
+                assert 'The number of clusters must be between 1 and 10' in rv.data.decode('utf-8')
+            self.assertEqual(mock_run_job_flow.call_count, 0)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'run_job_flow')
+    def test_invalid_spot_price(self, mock_run_job_flow):
+        with app.test_client() as c:
+            c.get('/?config_path=%s' % self.test_config_file)
+
+            # A spot price that is not a positive number is reported, with or without fleets
+            for instance_types in ["", "r4.4xlarge:2"]:
+                rv = c.post(url_for('cluster_list_create', account="test-4"),
+                            data=dict(name="cluster-1", subnet_id="subnet-12345678",
+                                      instance_type="r4.2xlarge", use_spot="true",
+                                      spot_price="cheap", instance_types=instance_types))
+                self.assertEqual(rv.status_code, 200)
+                assert 'The spot price must be a positive number' in rv.data.decode('utf-8')
+            self.assertEqual(mock_run_job_flow.call_count, 0)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch('spark_notebook.cloud.aws.AWS.find_idle_clusters')
+    def test_invalid_idle_hours(self, mock_find_idle_clusters):
+        with app.test_client() as c:
+            c.get('/?config_path=%s' % self.test_config_file)
+
+            # Hours that are not positive numbers are reported, not swept
+            for idle_hours in ["soon", "-1", "nan"]:
+                rv = c.post(url_for('sweep_idle_clusters', account="test-4"),
+                            data=dict(idle_hours=idle_hours), follow_redirects=True)
+                self.assertEqual(rv.status_code, 200)
+                assert 'must be a positive number' in rv.data.decode('utf-8')
+            self.assertEqual(mock_find_idle_clusters.call_count, 0)
+
 
 if __name__ == '__main__':
     unittest.main()
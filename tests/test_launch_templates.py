@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+from mock import patch
+from spark_notebook.cloud.aws import AWS
+from spark_notebook.config import Config
+from spark_notebook.config import default_config
+from spark_notebook.exceptions import ConfigException
+from spark_notebook.launch_templates import build_launch_templates
+from spark_notebook.launch_templates import parse_instance_types
+from spark_notebook.launch_templates import parse_spot_price
+from tests import IsolatedTestCase
+from tests import fake_boto
+
+
+class LaunchTemplatesTestCase(IsolatedTestCase):
+
+    def setUp(self):
+        self.config = copy.deepcopy(default_config)
+        self.config["templates"] = {
+            "workshop": {"instance-type": "m4.xlarge", "worker-count": 3, "spot": True,
+                         "spot-price": 0.5, "python-version": 2,
+                         "bootstrap-path": "s3://bucket/script.sh"},
+            "defaults": None,
+        }
+
+    def tearDown(self):
+        pass
+
+    def test_build(self):
+        launch_templates = build_launch_templates(self.config)
+        self.assertEqual(sorted(launch_templates), ["defaults", "workshop"])
+
+        workshop = launch_templates["workshop"]
+        master, core = workshop["Instances"]["InstanceGroups"]
+        self.assertEqual((core["InstanceType"], core["InstanceCount"], core["Market"],
+                          core["BidPrice"]), ("m4.xlarge", 3, "SPOT", "0.5"))
+        assert "Configurations" not in master
+        self.assertEqual(workshop["BootstrapActions"][0]["ScriptBootstrapAction"]["Args"],
+                         ["change-me-321", "2"])
+        self.assertEqual(workshop["BootstrapActions"][1]["ScriptBootstrapAction"]["Path"],
+                         "s3://bucket/script.sh")
+
+        # Settings missing from a template come from the emr section
+        core = launch_templates["defaults"]["Instances"]["InstanceGroups"][1]
+        self.assertEqual((core["InstanceType"], core["InstanceCount"], core["Market"]),
+                         ("r4.2xlarge", 1, "ON_DEMAND"))
+        assert "Configurations" in core
+
+    def test_validation(self):
+        invalid_templates = [
+            {"instance_type": "m4.xlarge"},
+            {"worker-count": 0},
+            {"worker-count": "many"},
+            {"spot": "yes"},
+            {"spot": True, "spot-price": -1},
+            {"spot": True, "spot-price": "cheap"},
+            {"bootstrap-path": "http://example.com/script.sh"},
+            {"python-version": "3.6"},
+            ["m4.xlarge"],
+            {"instance-types": {"m4.2xlarge": 0}},
+            {"instance-types": ["m4.large", "m5.large", "m5.xlarge", "c4.xlarge", "c5.xlarge"]},
+            {"instance-types": ["m4.2xlarge"], "spot": True, "spot-timeout": 2},
+        ]
+        for template in invalid_templates:
+            self.config["templates"] = {"broken": template}
+            with self.assertRaises(ConfigException) as context:
+                build_launch_templates(self.config)
+            assert "broken" in context.exception.msg
+
+    def test_instance_fleets(self):
+        self.config["templates"]["workshop"]["instance-types"] = {"m4.2xlarge": 2, "m4.xlarge": 1}
+        self.config["templates"]["workshop"]["spot-timeout"] = 20
+        instances = build_launch_templates(self.config)["workshop"]["Instances"]
+        assert "InstanceGroups" not in instances
+        master, core = instances["InstanceFleets"]
+
+        # The master fleet has a single instance of any of the types
+        self.assertEqual(master["TargetSpotCapacity"], 1)
+        self.assertEqual([(config["InstanceType"], config["WeightedCapacity"])
+                          for config in master["InstanceTypeConfigs"]],
+                         [("m4.xlarge", 1), ("m4.2xlarge", 1)])
+
+        # The worker count is the capacity of the core fleet and the bids are per unit
+        self.assertEqual(core["TargetSpotCapacity"], 3)
+        self.assertEqual([(config["InstanceType"], config["WeightedCapacity"],
+                           config["BidPrice"]) for config in core["InstanceTypeConfigs"]],
+                         [("m4.xlarge", 1, "0.5"), ("m4.2xlarge", 2, "1.0")])
+        self.assertEqual(core["LaunchSpecifications"]["SpotSpecification"],
+                         {"TimeoutDurationMinutes": 20, "TimeoutAction": "SWITCH_TO_ON_DEMAND"})
+
+        # On-demand fleets have no spot settings
+        self.config["templates"]["workshop"]["spot"] = False
+        instances = build_launch_templates(self.config)["workshop"]["Instances"]
+        core = instances["InstanceFleets"][1]
+        self.assertEqual(core["TargetOnDemandCapacity"], 3)
+        assert "LaunchSpecifications" not in core
+        assert "BidPrice" not in core["InstanceTypeConfigs"][0]
+
+    def test_parse_instance_types(self):
+        self.assertEqual(parse_instance_types("r4.4xlarge:2, r5.2xlarge,,r4.2xlarge",
+                                              "r4.2xlarge"),
+                         [("r4.4xlarge", 2), ("r5.2xlarge", 1)])
+        self.assertEqual(parse_instance_types(""), [])
+        with self.assertRaises(ConfigException):
+            parse_instance_types("r4.4xlarge:two")
+
+    def test_parse_spot_price(self):
+        self.assertEqual(parse_spot_price("0.25"), 0.25)
+        for value in ["cheap", "0", "-1", "nan", None]:
+            with self.assertRaises(ConfigException):
+                parse_spot_price(value)
+
+    def test_built_once(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            config_file = os.path.join(temp_dir, "config.yaml")
+            with open(config_file, 'w') as stream:
+                stream.write(yaml.safe_dump(self.config))
+            config = Config(file_path=config_file)
+
+            # The templates are built once for every snapshot of the config
+            launch_templates = config.launch_templates
+            assert config.launch_templates is launch_templates
+
+            config.set("emr", "instance-type", "m4.large")
+            assert config.launch_templates is not launch_templates
+            self.assertEqual(config.launch_templates["defaults"]["Instances"]["InstanceGroups"]
+                             [0]["InstanceType"], "m4.large")
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @patch('boto3.client', fake_boto.FakeBotoClient)
+    @patch.object(fake_boto.FakeBotoClient, 'set_run_job_flow_expected')
+    def test_launch(self, mock_run_job_flow_expected):
+        launch_template = build_launch_templates(self.config)["workshop"]
+        pristine = copy.deepcopy(launch_template)
+        cloud_account = AWS("access_key_id", "secret_access_key", "us-east-1")
+
+        # The account, subnet, name and tags are added to a copy of the template
+        expected = dict(copy.deepcopy(launch_template),
+                        Name="workshop-1",
+                        LogUri="s3://aws-logs-123456789012-us-east-1/elasticmapreduce/",
+                        Tags=[])
+        expected["Instances"].update(Ec2KeyName="key_name", Ec2SubnetId="subnet-12345678")
+        mock_run_job_flow_expected.return_value = expected
+
+        cluster_ids, errors = cloud_account.launch_clusters(launch_template, 1, "workshop",
+                                                            "key_name", "subnet-12345678", [])
+        self.assertEqual(errors, [])
+        self.assertEqual(len(cluster_ids), 1)
+        self.assertEqual(launch_template, pristine)
+
+
+if __name__ == '__main__':
+    unittest.main()
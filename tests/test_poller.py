@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import unittest
+from mock import Mock
+from spark_notebook.cloud.poller import ClusterPoller
+from spark_notebook.cloud.poller import ClusterWatcher
+from spark_notebook.cloud.poller import IdleClusterSweeper
+from spark_notebook.cloud.poller import PollerRegistry
+from spark_notebook.cloud.poller import WatcherRegistry
+from spark_notebook.exceptions import AWSException
+
+
+class PollerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cloud_account = Mock()
+        self.cloud_account.get_subnets.return_value = {'Subnets': []}
+
+    def tearDown(self):
+        pass
+
+    def set_states(self, *states):
+        self.cloud_account.list_clusters.return_value = {
+            'Clusters': [{'Id': 'J-%d' % i, 'Status': {'State': state}}
+                         for i, state in enumerate(states)]
+        }
+
+    def test_adaptive_interval(self):
+        poller = ClusterPoller(self.cloud_account, fast_interval=1, slow_interval=60)
+
+        # Poll quickly while a cluster is starting
+        self.set_states('STARTING', 'WAITING')
+        poller.poll()
+        self.assertEqual(len(poller.snapshot['clusters']['Clusters']), 2)
+        self.assertEqual(poller.interval(), 1)
+
+        # Poll slowly once every cluster has settled, without refetching the subnets
+        self.set_states('WAITING')
+        poller.poll()
+        self.assertEqual(poller.interval(), 60)
+        self.assertEqual(self.cloud_account.get_subnets.call_count, 1)
+
+    def test_poll_error_keeps_snapshot(self):
+        poller = ClusterPoller(self.cloud_account)
+
+        self.set_states('RUNNING')
+        poller.poll()
+
+        self.cloud_account.list_clusters.side_effect = AWSException("Throttled")
+        poller.poll()
+
+        # The last known clusters are kept along with the error
+        self.assertEqual(poller.snapshot['error'], "Throttled")
+        self.assertEqual(poller.snapshot['clusters']['Clusters'][0]['Id'], 'J-0')
+
+    def test_poll_unexpected_error(self):
+        poller = ClusterPoller(self.cloud_account)
+
+        self.set_states('RUNNING')
+        poller.poll()
+
+        # Errors that are not AWSExceptions are recorded the same way instead of ending the thread
+        self.cloud_account.list_clusters.side_effect = IOError("Could not connect")
+        poller.poll()
+        assert "Could not connect" in poller.snapshot['error']
+        self.assertEqual(poller.snapshot['clusters']['Clusters'][0]['Id'], 'J-0')
+
+    def test_registry_snapshot(self):
+        registry = PollerRegistry()
+        self.assertEqual(registry.snapshot("test-4"), None)
+
+        self.set_states('RUNNING')
+        poller = registry.add("test-4", self.cloud_account)
+        try:
+            poller.join(0.1)
+            assert "test-4" in registry
+            self.assertEqual(registry.snapshot("test-4")['clusters']['Clusters'][0]['Id'], 'J-0')
+        finally:
+            registry.stop_all()
+
+    def test_registry_poll(self):
+        registry = PollerRegistry()
+        self.set_states('RUNNING')
+        registry.add("test-5", self.cloud_account)
+        try:
+            # The snapshot reflects a change as soon as poll returns
+            self.set_states('RUNNING', 'STARTING')
+            registry.poll("test-5")
+            self.assertEqual(len(registry.snapshot("test-5")['clusters']['Clusters']), 2)
+        finally:
+            registry.stop_all()
+
+    def test_registry_sync(self):
+        def cloud_account(secret_access_key):
+            account = Mock(access_key_id="key", secret_access_key=secret_access_key,
+                           region_name="us-east-1")
+            account.get_subnets.return_value = {'Subnets': []}
+            account.list_clusters.return_value = {'Clusters': []}
+            return account
+
+        registry = PollerRegistry()
+        try:
+            registry.sync({"kept": cloud_account("a"), "changed": cloud_account("a"),
+                           "removed": cloud_account("a")})
+            kept = registry.get("kept")
+            removed = registry.get("removed")
+
+            # New accounts get a poller, changed keys a new one and removed accounts none
+            registry.sync({"kept": cloud_account("a"), "changed": cloud_account("b"),
+                           "added": cloud_account("a")})
+            self.assertEqual(sorted(registry.accounts()), ["added", "changed", "kept"])
+            assert registry.get("kept") is kept
+            self.assertEqual(registry.get("changed").cloud_account.secret_access_key, "b")
+            removed.join(1)
+            assert not removed.is_alive()
+        finally:
+            registry.stop_all()
+
+    def test_sweeper_owner(self):
+        registry = PollerRegistry()
+        self.set_states('WAITING')
+        registry.add("test-6", self.cloud_account)
+        try:
+            self.cloud_account.find_idle_clusters.return_value = ['J-0']
+            sweeper = IdleClusterSweeper(registry, 3600, {"test-6": "test-6@email"}.__getitem__)
+
+            # Only the clusters of the account are looked for and terminated
+            self.assertEqual(sweeper.sweep("test-6"), ['J-0'])
+            self.cloud_account.find_idle_clusters.assert_called_with(3600, owner="test-6@email")
+            self.cloud_account.terminate_clusters.assert_called_with(['J-0'])
+
+            # An account that is gone from the credentials is skipped
+            sweeper.owner = {}.__getitem__
+            self.assertEqual(sweeper.sweep("test-6"), [])
+        finally:
+            registry.stop_all()
+
+    def set_cluster(self, state, dns_name=None):
+        cluster = {'Cluster': {'Id': 'J-1', 'Status': {'State': state}}}
+        if dns_name is not None:
+            cluster['Cluster']['MasterPublicDnsName'] = dns_name
+        self.cloud_account.describe_cluster.return_value = cluster
+
+    def test_watcher_transitions(self):
+        watcher = ClusterWatcher(self.cloud_account, 'J-1')
+
+        self.set_cluster('STARTING')
+        watcher.poll()
+        self.assertEqual(watcher.version, 1)
+
+        # Polls without a state or DNS name change do not produce a new status
+        watcher.poll()
+        self.assertEqual(watcher.version, 1)
+
+        self.set_cluster('STARTING', 'master.cluster')
+        watcher.poll()
+        self.assertEqual(watcher.wait(1, timeout=0),
+                         (2, {'state': 'STARTING', 'state_message': None,
+                              'master_public_dns_name': 'master.cluster'}))
+
+    def test_watcher_shared_between_subscribers(self):
+        registry = WatcherRegistry()
+
+        self.set_cluster('STARTING')
+        first = registry.subscribe('test-4', 'J-1', self.cloud_account)
+        second = registry.subscribe('test-4', 'J-1', self.cloud_account)
+
+        # A single watcher polls for both subscribers
+        assert first is second
+        self.assertEqual(first.wait(0, timeout=1)[1]['state'], 'STARTING')
+        self.assertEqual(self.cloud_account.describe_cluster.call_count, 1)
+
+        # The watcher keeps running until the last subscriber leaves
+        registry.unsubscribe('test-4', 'J-1', first)
+        assert not first.finished
+        registry.unsubscribe('test-4', 'J-1', second)
+        first.join(1)
+        assert first.finished
+
+        # A new subscriber gets a new watcher
+        third = registry.subscribe('test-4', 'J-1', self.cloud_account)
+        assert third is not first
+        registry.unsubscribe('test-4', 'J-1', third)
+
+
+if __name__ == '__main__':
+    unittest.main()
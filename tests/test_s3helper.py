@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+import time
+import types
+import unittest
+from mock import Mock
+from mock import patch
+
+# s3helper runs on the cluster and is not part of the package. It is imported with boto
+# stubbed, as the helpers tested here do not talk to S3.
+REMOTE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "provision", "remote")
+
+
+def _boto_stub():
+    modules = dict()
+    for name, attributes in [("boto", []),
+                             ("boto.exception", ["S3ResponseError"]),
+                             ("boto.s3", []),
+                             ("boto.s3.connection", ["S3Connection"]),
+                             ("boto.s3.multipart", ["MultiPartUpload"]),
+                             ("boto.s3.prefix", ["Prefix"]),
+                             ("boto.utils", ["parse_ts"])]:
+        module = types.ModuleType(name)
+        for attribute in attributes:
+            setattr(module, attribute, Mock())
+        modules[name] = module
+    return modules
+
+
+with patch.dict(sys.modules, _boto_stub()), patch.object(sys, "path", [REMOTE_PATH] + sys.path):
+    import s3helper
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+class S3HelperTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_chunks(self):
+        files = ["/a/%d" % i for i in range(5)]
+        self.assertEqual(list(s3helper._chunks(files, 2, 1000)),
+                         [files[0:2], files[2:4], files[4:5]])
+
+        # Every chunk fits in max_length characters, one separator per path included
+        self.assertEqual(list(s3helper._chunks(files, 10, 10)),
+                         [files[0:2], files[2:4], files[4:5]])
+
+        # A path longer than max_length still gets a chunk of its own
+        self.assertEqual(list(s3helper._chunks(["/long/path", "/b"], 10, 4)),
+                         [["/long/path"], ["/b"]])
+        self.assertEqual(list(s3helper._chunks([], 10, 10)), [])
+
+    def test_delta(self):
+        source = {"new": (1, 1000), "same": (1, 1000), "resized": (2, 1000),
+                  "newer": (1, 2000), "tolerated": (1, 1000 + s3helper.SYNC_TOLERANCE)}
+        target = {"same": (1, 1000), "resized": (1, 1000), "newer": (1, 1000),
+                  "tolerated": (1, 1000), "extra": (1, 1000)}
+        self.assertEqual(s3helper._delta(source, target), (["new"], ["newer", "resized"]))
+
+    def test_parts(self):
+        self.assertEqual(s3helper._parts(10, 4), [(1, 0, 4), (2, 4, 4), (3, 8, 2)])
+        self.assertEqual(s3helper._parts(8, 4), [(1, 0, 4), (2, 4, 4)])
+        self.assertEqual(s3helper._parts(0, 4), [])
+
+    def test_parse_progress(self):
+        progress = dict()
+        assert not s3helper._parse_progress("INFO mapreduce.Job: Running job: job_1528_0007",
+                                            progress)
+        self.assertEqual(progress, {"application_id": "application_1528_0007"})
+
+        assert s3helper._parse_progress("INFO mapreduce.Job:  map 42% reduce 0%", progress)
+        assert s3helper._parse_progress("\t\tBytes Copied=1024", progress)
+        assert s3helper._parse_progress("\t\tBytes Expected=4096", progress)
+        assert s3helper._parse_progress("\t\tFiles Copied=3", progress)
+
+        # Lines that repeat the progress do not change it, and the first application is kept
+        assert not s3helper._parse_progress("INFO mapreduce.Job:  map 42% reduce 0%", progress)
+        assert not s3helper._parse_progress("Submitted application application_1528_0008",
+                                            progress)
+        self.assertEqual(progress, {"application_id": "application_1528_0007", "percent": 42,
+                                    "bytes": 1024, "bytes_expected": 4096, "files": 3})
+
+    def test_ls_hdfs_files(self):
+        listing = "\n".join([
+            "Found 3 items",
+            "drwxr-xr-x   - hadoop hadoop          0 2018-01-01 00:00 /data/dir",
+            "-rw-r--r--   1 hadoop hadoop       1234 2018-01-01 00:01 /data/file.csv",
+            "-rw-r--r--   1 hadoop hadoop         56 2018-01-02 10:30 /data/with space.csv",
+        ])
+        with patch.object(s3helper, "_run_command") as mock_run_command:
+            mock_run_command.return_value = s3helper._Result(0, listing, "", {}, False, False)
+            self.assertEqual(list(s3helper._ls_hdfs_files(["-R", "/data"])),
+                             [("/data/file.csv", 1234, 1514764860),
+                              ("/data/with space.csv", 56, 1514889000)])
+            self.assertEqual(mock_run_command.call_args[0][0],
+                             ["/usr/bin/hdfs", "dfs", "-ls", "-R", "/data"])
+
+            # A failed listing lists nothing
+            mock_run_command.return_value = s3helper._Result(1, "", "No such file", {}, False,
+                                                             False)
+            self.assertEqual(list(s3helper._ls_hdfs_files(["/missing"])), [])
+
+    def test_run_command(self):
+        result = s3helper._run_command(_python(
+            "import sys; print('out'); sys.stderr.write('err\\n'); sys.exit(3)"))
+        self.assertEqual((result.returncode, result.out, result.err), (3, "out", "err"))
+        assert not result.timed_out and not result.cancelled
+
+        result = s3helper._run_command(_python("print('out')"), keep_output=False)
+        self.assertEqual(result.out, None)
+
+    def test_run_command_drains_stderr(self):
+        # A command writing more than a pipe holds to stderr finishes, and the last lines of its
+        # errors are kept
+        result = s3helper._run_command(_python(
+            "import sys\n"
+            "for i in range(100000): sys.stderr.write('line %d\\n' % i)\n"
+            "print('done')"), timeout=30)
+        self.assertEqual((result.returncode, result.out), (0, "done"))
+        err = result.err.splitlines()
+        self.assertEqual(len(err), s3helper.ERROR_LINES)
+        self.assertEqual(err[-1], "line 99999")
+
+    @patch.object(s3helper, "_kill_application")
+    def test_run_command_timeout(self, mock_kill_application):
+        started = time.time()
+        result = s3helper._run_command(_python(
+            "import sys, time\n"
+            "sys.stderr.write('Submitted application application_1528_0009\\n')\n"
+            "sys.stderr.flush()\n"
+            "time.sleep(30)"), timeout=0.5)
+        assert time.time() - started < 10
+        assert result.timed_out and not result.cancelled
+        self.assertNotEqual(result.returncode, 0)
+        assert "timed out after 0.5 seconds" in result.err
+
+        # The YARN application the command submitted is killed along with it
+        self.assertEqual(mock_kill_application.call_args[0][0]["application_id"],
+                         "application_1528_0009")
+
+    @patch.object(s3helper, "_kill_application")
+    def test_run_command_cancel(self, mock_kill_application):
+        cancel = threading.Event()
+        timer = threading.Timer(0.5, cancel.set)
+        timer.start()
+        started = time.time()
+        try:
+            result = s3helper._run_command(_python("import time; time.sleep(30)"), cancel=cancel)
+        finally:
+            timer.cancel()
+        assert time.time() - started < 10
+        assert result.cancelled and not result.timed_out
+        self.assertNotEqual(result.returncode, 0)
+        assert "Command cancelled" in result.err
+        self.assertEqual(mock_kill_application.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
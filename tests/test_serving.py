@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+from flask import Flask
+from spark_notebook.serving import create_server
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+
+class ServingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.threads = set()
+
+        @self.app.route('/')
+        def index():
+            self.threads.add(threading.current_thread().name)
+            return "ok"
+
+        self.server = create_server(self.app, "127.0.0.1", 0, threads=2, keep_alive=5)
+        self.serve_thread = threading.Thread(target=self.server.run)
+        self.serve_thread.daemon = True
+        self.serve_thread.start()
+
+    def tearDown(self):
+        self.server.task_dispatcher.shutdown()
+        self.server.close()
+
+    def test_keep_alive(self):
+        connection = HTTPConnection("127.0.0.1", self.server.effective_port, timeout=5)
+
+        # Several requests are served over the same connection by the worker threads
+        for _ in range(3):
+            connection.request("GET", "/")
+            response = connection.getresponse()
+            self.assertEqual(response.read(), b"ok")
+            self.assertEqual(response.version, 11)
+            self.assertNotEqual(response.getheader("Connection"), "close")
+        connection.close()
+
+        self.assertNotIn(self.serve_thread.name, self.threads)
+        self.assertNotIn(threading.current_thread().name, self.threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -55,7 +55,7 @@ class SparkNotebookTestCase(unittest.TestCase):
             # Read the YAML from temp_config_file
             if os.path.isfile(self.temp_config_file):
                 with open(self.temp_config_file, 'r') as stream:
-                    test_config_yaml = yaml.load(stream)
+                    test_config_yaml = yaml.safe_load(stream)
             else:
                 self.fail("Missing: %s " % self.temp_config_file)
 
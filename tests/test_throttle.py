@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import botocore.exceptions
+import unittest
+from mock import Mock
+from mock import patch
+from spark_notebook.cloud.throttle import ThrottledClient
+from spark_notebook.cloud.throttle import TokenBucket
+from spark_notebook.cloud.throttle import stats
+
+
+class ThrottleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [0.0]
+        self.clock = lambda: self.now[0]
+
+        stats.reset()
+
+    def tearDown(self):
+        pass
+
+    def sleep(self, seconds):
+        self.now[0] += seconds
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2.0, capacity=2, clock=self.clock, sleep=self.sleep)
+
+        # The burst is served straight away
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+
+        # Then requests wait for the bucket to refill
+        self.assertEqual(bucket.acquire(), 0.5)
+        self.assertEqual(self.now[0], 0.5)
+
+        # Idle time refills the bucket up to its capacity
+        self.now[0] += 10
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0.5)
+
+    @patch('time.sleep')
+    def test_throttled_client(self, mock_sleep):
+        throttled = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'emr')
+        denied = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'Denied'}}, 'emr')
+
+        client = Mock()
+        client.describe_cluster.side_effect = [throttled, throttled, {'Cluster': {}}]
+        client.list_clusters.side_effect = denied
+
+        bucket = TokenBucket(clock=self.clock, sleep=self.sleep)
+        throttled_client = ThrottledClient(client, bucket)
+
+        # Throttled calls are retried after a backoff
+        self.assertEqual(throttled_client.describe_cluster(ClusterId='J-1'), {'Cluster': {}})
+        self.assertEqual(client.describe_cluster.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+        # Other errors are raised straight away
+        self.assertRaises(botocore.exceptions.ClientError, throttled_client.list_clusters)
+        self.assertEqual(client.list_clusters.call_count, 1)
+
+        counters = stats.as_dict()
+        self.assertEqual((counters['calls'], counters['throttled'], counters['retries']),
+                         (4, 2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()